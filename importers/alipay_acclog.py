@@ -1,20 +1,20 @@
 #!/usr/bin/env python
 '''Beancount importer for Alipay online payments'''
 
+import os
 import sys
 import csv
 import argparse
-import datetime
 
+# modules shared with union_importer
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'union_importer'))
 
-def _amount_match(a1, a2):
-    d1 = float(a1) if a1 else 0
-    d2 = float(a2) if a2 else 0
-
-    if d1 + d2 == 0:
-        return True
-
-    return False
+import alipay  # noqa: E402
+from base import parse_amount  # noqa: E402
+from csvfile import open_csv_argument  # noqa: E402
+from timeparse import parse_iso_datetime  # noqa: E402
+from writer import open_output  # noqa: E402
 
 
 def _beancount_account_for_source(source):
@@ -33,8 +33,8 @@ class AliTransaction(object):
 
         self.tradeNo = row[0].strip()  # 流水号
         self.dateString = row[1].strip()  # 时间
-        self.datetime = datetime.datetime.strptime(self.dateString, "%Y-%m-%d %H:%M:%S")
-        self.time = self.datetime.strftime("%H:%M:%S")
+        self.datetime, self.date, self.time = \
+            parse_iso_datetime(self.dateString)
         self.name = row[2].strip()  # 名称
         self.comment = row[3].strip()  # 备注
         self.income = row[4].strip()  # 收入
@@ -42,6 +42,10 @@ class AliTransaction(object):
         self.remain = row[6].strip()  # 账户余额
         self.source = row[7].strip()  # 资金渠道
 
+        # parsed once for matching, strings are kept for output
+        self.income_value = parse_amount(self.income)
+        self.expenses_value = parse_amount(self.expenses)
+
     def is_alipay_source(self):
         return self.source == "支付宝"
 
@@ -58,7 +62,7 @@ class AliTransaction(object):
         return len(self.income) > 0
 
     def beancount_date(self):
-        return self.datetime.strftime("%Y-%m-%d")
+        return self.date
 
     def postings(self):
         beancount_account = self.beancount_account()
@@ -94,50 +98,20 @@ class AliTransaction(object):
     def beancount_account(self):
         return _beancount_account_for_source(self.source)
 
-    def is_looks_same(self, other):
-        dateDelta = self.datetime - other.datetime
-        if dateDelta.total_seconds() > 5:
-            return False
-        if _amount_match(self.income, other.expenses) is False:
-            return False
-        if _amount_match(self.expenses, other.income) is False:
-            return False
-
-        return True
 
-
-class TransactionCombiner(object):
-
-    def __init__(self):
-        super(TransactionCombiner, self).__init__()
-        self.pendingRows = []
+class TransactionCombiner(alipay.TransactionCombiner):
+    """Combine the expenses and income rows of a transfer within 5
+    seconds, the same as union_importer, results are parsed dicts
+    """
 
     def push_row(self, row):
-        at = AliTransaction(row)
-        self.pendingRows.append(at)
-
-    def resolve(self):
-        if len(self.pendingRows) > 1:
-            ac1 = self.pendingRows[0]
-            ac2 = self.pendingRows[1]
-            if ac1.is_looks_same(ac2):
-                d = self.combine(ac1, ac2)
-                self.pendingRows = []
-                return d
-            else:
-                d = self.single(ac1)
-                self.pendingRows.pop(0)
-                return d
-
-    def final(self):
-        assert len(self.pendingRows) < 2
-
-        if len(self.pendingRows) > 0:
-            ac1 = self.pendingRows[0]
-            self.pendingRows.pop(0)
-            return self.single(ac1)
+        """Push the next csv row, return parsed results which are done
+        """
+        return self.push_trans(AliTransaction(row))
 
     def combine(self, ac1, ac2):
+        if ac2 is None:
+            return self.single(ac1)
         assert ac1 != ac2
 
         assetFrom = ac1 if ac1.is_income() else ac2
@@ -223,16 +197,11 @@ def parse_alipay_acclog(csv_data, args):
             continue
 
         # start process contents
-        tc.push_row(row)
-        d = tc.resolve()
-        if d:
-            d['flag'] = '*' if args._pass else '!'
-            parsed.append(d)
-
-    d = tc.final()
-    if d:
+        parsed.extend(tc.push_row(row))
+    parsed.extend(tc.final())
+
+    for d in parsed:
         d['flag'] = '*' if args._pass else '!'
-        parsed.append(d)
 
     return parsed
 
@@ -250,28 +219,39 @@ def compose_beans(parsed):
     return beans
 
 
-def print_beans(beans, filename=None):
+def format_beans(beans, filename=None):
     header = (
         '; vim: ft=beancount nofoldenable:\n'
         '; Imported from {}\n\n'.format(filename)
     )
     sep = '\n' * 2
-    print(header)
-    print(sep.join(beans))
+    return header + '\n' + sep.join(beans) + '\n'
+
+
+def print_beans(beans, filename=None, out=None):
+    if out is None:
+        out = sys.stdout
+    out.write(format_beans(beans, filename))
 
 
 def main():
     argparser = argparse.ArgumentParser()
     argparser.add_argument(
-        'csv', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
-        help='CSV file of Alipay ACCLOG(余额收支明细)'
+        'csv', nargs='?', default='-',
+        help='CSV file of Alipay ACCLOG(余额收支明细), - or none for stdin'
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
     args = argparser.parse_args()
 
-    parsed = parse_alipay_acclog(args.csv, args)
+    with open_csv_argument(args.csv) as csv_data:
+        parsed = parse_alipay_acclog(csv_data, args)
     beans = compose_beans(parsed)
-    print_beans(beans, args.csv.name)
+    with open_output(args.output) as out:
+        print_beans(beans, csv_data.name, out)
 
 
 if __name__ == '__main__':
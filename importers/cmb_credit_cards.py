@@ -1,10 +1,18 @@
 #!/usr/bin/env python
 '''Beancount importer for China Merchants Bank credit cards'''
 
+import os
 import sys
 import csv
 import argparse
 
+# modules shared with union_importer
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'union_importer'))
+
+from csvfile import open_csv_argument  # noqa: E402
+from writer import open_output  # noqa: E402
+
 
 class CMBCreditCardParser(object):
 
@@ -56,26 +64,38 @@ def compose_beans(parsed):
     return beans
 
 
-def print_beans(beans, filename=None):
+def format_beans(beans, filename=None):
     header = '\n; Imported from {}'.format(filename)
     sep = '\n' * 2
-    print(header)
-    print(sep.join(beans))
+    return header + '\n' + sep.join(beans) + '\n'
+
+
+def print_beans(beans, filename=None, out=None):
+    if out is None:
+        out = sys.stdout
+    out.write(format_beans(beans, filename))
 
 
 def main():
     argparser = argparse.ArgumentParser()
     argparser.add_argument(
-        'csv', nargs='?', type=argparse.FileType(mode='r', encoding='utf-8'), default=sys.stdin,
-        help='CSV file of China Merchants Bank credit card bill'
+        'csv', nargs='?', default='-',
+        help='CSV file of China Merchants Bank credit card bill, '
+             '- or none for stdin'
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
     args = argparser.parse_args()
 
-    parser = CMBCreditCardParser(args.csv)
-    parsed = parser.parse(default_pass=args._pass)
+    with open_csv_argument(args.csv) as csv_data:
+        parser = CMBCreditCardParser(csv_data)
+        parsed = parser.parse(default_pass=args._pass)
     beans = compose_beans(parsed)
-    print_beans(beans, args.csv.name)
+    with open_output(args.output) as out:
+        print_beans(beans, csv_data.name, out)
 
 
 if __name__ == '__main__':
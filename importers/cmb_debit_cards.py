@@ -1,23 +1,77 @@
 #!/usr/bin/env python
 '''Beancount importer for China Merchants Bank debit cards'''
 
+import os
 import sys
 import csv
 import argparse
-from datetime import datetime
+
+# modules shared with union_importer
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'union_importer'))
+
+from csvfile import open_csv  # noqa: E402
+from csvfile import open_csv_argument  # noqa: E402
+from csvfile import reversed_lines  # noqa: E402
+from timeparse import parse_compact_datetime  # noqa: E402
+from writer import open_output  # noqa: E402
+
+
+def _is_data_row(row):
+    # Skip empty lines, comment lines, and table headers
+    if not row:
+        return False
+    if row[0].startswith('#') or row[0].startswith('交易时间'):
+        return False
+    return True
 
 
 class CMBDebitCardParser(object):
 
-    def __init__(self, csv_data, card_name):
+    def __init__(self, csv_data, card_name, path=None):
+        """path of csv_data if it is a plain file, which can be read
+        backwards
+        """
+        self.csv_data = csv_data
+        self.path = path
         self.reader = csv.reader(csv_data)
         self.card_name = card_name
         self.parsed = []
 
+    def _is_newest_first(self):
+        """Exports are newest first, check the first rows to be sure,
+        consumes self.reader
+        """
+        last = None
+        for row in self.reader:
+            if not _is_data_row(row):
+                continue
+            date = row[0].strip()
+            if last is not None and date != last:
+                return date < last
+            last = date
+        return True
+
+    def _rows_oldest_first(self):
+        if self.path is None or not os.path.isfile(self.path) or \
+           self.path.endswith('.gz'):
+            # a pipe can't be read backwards
+            for row in reversed(list(self.reader)):
+                yield row
+            return
+
+        if not self._is_newest_first():
+            with open_csv(self.path, self.csv_data.encoding) as csv_data:
+                for row in csv.reader(csv_data):
+                    yield row
+            return
+
+        for line in reversed_lines(self.path, self.csv_data.encoding):
+            for row in csv.reader([line]):
+                yield row
+
     def _expand_datetime(self, date):
-        orig_date = datetime.strptime(date, '%Y%m%d  %H:%M:%S')
-        iso_date = orig_date.date().strftime('%Y-%m-%d')
-        iso_time = orig_date.time().strftime('%H:%M:%S')
+        _, iso_date, iso_time = parse_compact_datetime(date)
         return iso_date, iso_time
 
     def _get_amounts(self, amount):
@@ -27,12 +81,11 @@ class CMBDebitCardParser(object):
         else:
             return '+' + _abs, '-' + _abs
 
-    def parse(self, default_pass=True):
-        for row in reversed(list(self.reader)):
-            # Skip empty lines, comment lines, and table headers
-            if not row:
-                continue
-            if row[0].startswith('#') or row[0].startswith('交易时间'):
+    def iter_parse(self, default_pass=True):
+        """Yield parsed rows oldest first, without keeping them
+        """
+        for row in self._rows_oldest_first():
+            if not _is_data_row(row):
                 continue
 
             d = {}
@@ -44,12 +97,16 @@ class CMBDebitCardParser(object):
                 row[1].strip().replace(',', '')
             )
             d['a_name'] = self.card_name
-            self.parsed.append(d)
+            yield d
 
+    def parse(self, default_pass=True):
+        self.parsed.extend(self.iter_parse(default_pass))
         return self.parsed
 
 
 def compose_beans(parsed):
+    """Yield entries of parsed rows, one at a time
+    """
     template = (
         '{date} {flag} "{narration}"\n'
         '  time: "{time}"\n'
@@ -57,31 +114,46 @@ def compose_beans(parsed):
         '  Assets:CMB:{a_name} {a} CNY\n'
         '  Equity:Uncategorized {e} CNY'
     )
-    beans = [template.format_map(p) for p in parsed]
-    return beans
+    for p in parsed:
+        yield template.format_map(p)
 
 
-def print_beans(beans, filename=None):
-    header = '\n; Imported from {}'.format(filename)
-    sep = '\n' * 2
-    print(header)
-    print(sep.join(beans))
+def print_beans(beans, filename=None, out=None):
+    """Write every entry as it comes, beans are not kept in memory
+    """
+    if out is None:
+        out = sys.stdout
+    out.write('\n; Imported from {}\n'.format(filename))
+    sep = ''
+    for bean in beans:
+        out.write(sep)
+        out.write(bean)
+        sep = '\n' * 2
+    out.write('\n')
 
 
 def main():
     argparser = argparse.ArgumentParser()
     argparser.add_argument(
-        'csv', nargs='?', type=argparse.FileType(mode='r', encoding='utf-8'), default=sys.stdin,
-        help='CSV file of China Merchants Bank debit card data'
+        'csv', nargs='?', default='-',
+        help='CSV file of China Merchants Bank debit card data, '
+             '- or none for stdin'
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
     argparser.add_argument('-n', '--name', required=True)
     args = argparser.parse_args()
 
-    parser = CMBDebitCardParser(args.csv, args.name)
-    parsed = parser.parse(default_pass=args._pass)
-    beans = compose_beans(parsed)
-    print_beans(beans, args.csv.name)
+    path = None if args.csv == '-' else args.csv
+    with open_csv_argument(args.csv) as csv_data:
+        parser = CMBDebitCardParser(csv_data, args.name, path)
+        parsed = parser.iter_parse(default_pass=args._pass)
+        beans = compose_beans(parsed)
+        with open_output(args.output) as out:
+            print_beans(beans, csv_data.name, out)
 
 
 if __name__ == '__main__':
@@ -5,38 +5,57 @@ import sys
 import csv
 import argparse
 from datetime import datetime
+from datetime import timedelta
 import os
 import base64
 import glob
+from collections import defaultdict
+from collections import deque
 
 from base import Account
 from base import Transaction
+from base import _amount_key
+from csvfile import open_csv_stream
+from timeparse import parse_iso_datetime
+import stats
+from stats import ImportStats
+from writer import open_output
 
 
-def _amount_match(a1, a2):
-    d1 = float(a1) if a1 else 0
-    d2 = float(a2) if a2 else 0
-    if d1+d2 == 0:
-        return True
-    return False
+def _amount_match(d1, d2):
+    if d1 is None or d2 is None:
+        return False
+    return d1 + d2 == 0
 
 
-def _datetime_approximate(t1, t2):
+def _datetime_near(t1, t2):
     dateDelta = t1.datetime - t2.datetime
-    return (dateDelta.total_seconds() <= 5)
+    return abs(dateDelta.total_seconds()) <= 5
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _time_bucket(dt):
+    """5 seconds wide bucket, rows within 5 seconds are in adjacent buckets
+    """
+    return int((dt - _EPOCH).total_seconds()) // 5
 
 
 def _amount_equal(t1, t2):
-    return (_amount_match(t1.expenses, t2.income) and
-            _amount_match(t1.income, t2.expenses))
+    return (_amount_match(t1.expenses_value, t2.income_value) and
+            _amount_match(t1.income_value, t2.expenses_value))
+
+
+_SOURCE_ACCOUNTS = {
+    '支付宝': 'Assets:Alipay',
+    '天弘基金': 'Assets:Alipay',
+    '招商银行': 'Liabilities:Bank:CMB:CreditCards',
+}
 
 
 def _beancount_account_for_source(source):
-    return {
-        '支付宝': 'Assets:Alipay',
-        '天弘基金': 'Assets:Alipay',
-        '招商银行': 'Liabilities:Bank:CMB:CreditCards',
-    }.get(source, 'Equity:Uncategorized')
+    return _SOURCE_ACCOUNTS.get(source, 'Equity:Uncategorized')
 
 
 class Alipay(Account):
@@ -51,36 +70,73 @@ class Alipay(Account):
 
         self.acclog_transactions = []
         self.record_transactions = []
+        # tradeNo of rows loaded, exported csv files may overlap
+        self.loaded_acclogs = set()
+        self.loaded_records = set()
+
+        self.record_by_tradeNo = {}
+        self.record_by_time = defaultdict(list)
 
     # csv processing
     def load_csv_data(self, csv_data):
-        self.current_csv_type(csv_data)
+        self.transactions = []
         self.parser_csv(csv_data)
         if self.is_acclog:
-            self.merge_acclog()
-            self.acclog_transactions.extend(self.transactions)
+            self.extend_unloaded(
+                self.acclog_transactions, self.loaded_acclogs,
+                self.transactions)
         else:
-            self.record_transactions.extend(self.transactions)
+            self.extend_unloaded(
+                self.record_transactions, self.loaded_records,
+                self.transactions)
+
+    def extend_unloaded(self, loaded, seen, transactions):
+        """Append rows of one csv file, rows whose tradeNo is in seen are
+        loaded from other csv files and dropped. A tradeNo can repeat in
+        one file, those rows are kept
+        """
+        found = set()
+        for t in transactions:
+            if t.tradeNo:
+                if t.tradeNo in seen:
+                    continue
+                found.add(t.tradeNo)
+            t.account = self
+            loaded.append(t)
+        seen.update(found)
+
+    def merge_loaded(self, other):
+        self.extend_unloaded(
+            self.acclog_transactions, self.loaded_acclogs,
+            other.acclog_transactions)
+        self.extend_unloaded(
+            self.record_transactions, self.loaded_records,
+            other.record_transactions)
+
+    def finish_loading(self):
+        self.transactions = []
+
+        with self.timed('merge_acclog') as s:
+            self.merge_acclog()
+            if s is not None:
+                s.rows = len(self.acclog_transactions)
+        with self.timed('merge_acclog_and_record') as s:
+            self.merge_acclog_and_record()
+            if s is not None:
+                s.rows = len(self.transactions)
+        self.transactions.sort(key=lambda t: t.sort_key())
 
-    def load_csv_directory(self, path):
-        for f in glob.glob(os.path.join(path, "*.csv")):
-            self.load_csv_file(f)
-            self.transactions = []
+    def loaded_rows(self):
+        return len(self.acclog_transactions) + len(self.record_transactions)
 
-        # TODO: mulitple csv with duplicated info
-        #  1. never mind just let it go
-        #  or 2. filter duplicated record/acclog
-        # self.filter_results()
+    def merge_counts(self):
+        matched = sum(1 for t in self.acclog_transactions if t.record)
+        return matched, len(self.transactions) - matched
 
-        self.merge_acclog_and_record()
-        self.transactions.sort(key=lambda t: t.sort_key())
-
-    def current_csv_type(self, csv_data):
-        reader = csv.reader(csv_data)
-        for row in reader:
-            self.is_acclog = row[0].strip().startswith('#支付宝收支明细')
-            break
-        csv_data.seek(0)
+    def header_sniffed(self, prefix, header):
+        row = prefix[0] if prefix else header
+        self.is_acclog = bool(row) and \
+            row[0].strip().startswith('#支付宝收支明细')
 
     def parser_row(self, row):
         if self.is_acclog:
@@ -101,47 +157,59 @@ class Alipay(Account):
 
     # transaction mergering
 
+    def index_records(self):
+        self.record_by_tradeNo = {}
+        self.record_by_time = defaultdict(list)
+        for pos, record in enumerate(self.record_transactions):
+            self.record_by_tradeNo.setdefault(record.tradeNo, record)
+            bucket = _time_bucket(record.datetime)
+            self.record_by_time[bucket].append((pos, record))
+
     def merge_acclog_and_record(self):
-        found = []
+        self.index_records()
+
+        found = set()
         for acclog in self.acclog_transactions:
             record = self.record_with_tradeNo(acclog.tradeNo)
             if not record:
                 record = self.find_record_with_acclog(acclog)
             acclog.record = record
-            found.append(record)
+            found.add(record)
 
         remainRecord = [x for x in self.record_transactions if x not in found]
 
         self.transactions = self.acclog_transactions + remainRecord
 
     def record_with_tradeNo(self, tradeNo):
-        for i in self.record_transactions:
-            if i.tradeNo == tradeNo:
-                return i
-        return None
+        return self.record_by_tradeNo.get(tradeNo)
 
     def find_record_with_acclog(self, acclog):
         source = acclog.source
 
-        for i in self.record_transactions:
+        bucket = _time_bucket(acclog.datetime)
+        nearby = []
+        for b in (bucket - 1, bucket, bucket + 1):
+            nearby.extend(self.record_by_time.get(b, ()))
+        # keep the csv order, first matched record wins
+        nearby.sort(key=lambda x: x[0])
+
+        for pos, i in nearby:
             if source in i.payee and \
-             _datetime_approximate(acclog, i) and \
+             _datetime_near(acclog, i) and \
              _amount_equal(acclog, i):
                 return i
         return None
 
     def merge_acclog(self):
+        """Combine acclog rows of transfers, after the rows of all csv
+        files are loaded, so a transfer split by two files is combined
+        """
         tr = []
         tc = TransactionCombiner()
-        for t in self.transactions:
-            tc.push_trans(t)
-            d = tc.resolve()
-            if d:
-                tr.append(d)
-        d = tc.final()
-        if d:
-            tr.append(d)
-        self.transactions = tr
+        for t in self.acclog_transactions:
+            tr.extend(tc.push_trans(t))
+        tr.extend(tc.final())
+        self.acclog_transactions = tr
 
     # output
     def print_bills(self):
@@ -158,17 +226,22 @@ class Alipay(Account):
 
 # Record
 class AliRecord(Transaction):
+    __slots__ = (
+        'tradeNo', 'orderNo', 'dateString', 'datetime', 'time',
+        'paymenDateStr', 'modifyDateStr', 'trade_from', 'type', 'name',
+        'is_income', 'success', 'fee', 'refund',
+        'acclog', 'record', 'relate', 'manager',
+    )
+
     def __init__(self, row):
-        super(AliRecord, self).__init__()
-        self.row = row
+        super(AliRecord, self).__init__(row)
 
         # csv fields mapping
         self.tradeNo = row[0].strip()  # 交易号
         self.orderNo = row[1].strip()  # 商户订单号
         self.dateString = row[2].strip()  # 交易创建时间
-        self.datetime = datetime.strptime(self.dateString, "%Y-%m-%d %H:%M:%S")
-        self.time = self.datetime.strftime("%H:%M:%S")
-        self.trade_date = self.datetime.strftime("%Y-%m-%d")
+        self.datetime, self.trade_date, self.time = \
+            parse_iso_datetime(self.dateString)
 
         self.paymenDateStr = row[3]  # 付款时间
         self.modifyDateStr = row[4]  # 最近修改时间
@@ -193,6 +266,7 @@ class AliRecord(Transaction):
         self.fee = row[12].strip()      # 服务费（元）
         self.refund = row[13].strip()   # 成功退款（元）
         self.comment = row[14].strip()  # 备注
+        self.parse_amounts()
 
         self.acclog = None
         self.record = None
@@ -203,51 +277,58 @@ class AliRecord(Transaction):
     def description(self):
         return self.name
 
+    def trade_datetime(self):
+        return self.datetime
+
+    def ledger_key(self):
+        return ('alipay record', self.tradeNo)
+
     # beancount stuff
-    def beancount_repr(self):
-        template = (
-            '{date} {flag} "{payee}" "{narration}"\n'
-            '{metadata}'
-            '{postings}'
+    @classmethod
+    def build_templates(cls):
+        head = (
+            '{0} ' + Account.beancount_flags + ' "{1}" "{2}"\n'
+            '  tradeNo:"{3}"\n'
+            '  trade_date:"{4}"\n'
+            '  bill:"alipay record"\n'
         )
+        return {
+            'expenses': head + (
+                '  ! {5} {6} CNY\n'
+                '  ! Expenses:Uncategorized +{7} CNY'),
+            'income': head + (
+                '  ! Income:Uncategorized -{6} CNY\n'
+                '  ! {5} +{6} CNY'),
+        }
 
-        d = {}
-        d['date'] = self.beancount_transaction_date()
-        d['flag'] = Account.beancount_flags
-        d['payee'] = self.payee
-        d['narration'] = self.name
-        d['metadata'] = (
-            '  tradeNo:"{0.tradeNo}"\n'
-            '  trade_date:"{0.trade_date}"\n'
-            '  bill:"alipay record"\n'
-            ).format(self)
+    def beancount_repr(self):
+        templates = self.templates()
         if self.expenses:
-            d['postings'] = (
-                '  ! {1} {0.expenses} CNY\n'
-                '  ! Expenses:Uncategorized +{0.amount} CNY'
-                ).format(self, self.beancount_account())
-        else:
-            d['postings'] = (
-                '  ! Income:Uncategorized -{0.income} CNY\n'
-                '  ! {1} +{0.income} CNY'
-                ).format(self, self.beancount_account())
-
-        return template.format_map(d)
+            return templates['expenses'].format(
+                self.beancount_transaction_date(), self.payee, self.name,
+                self.tradeNo, self.trade_date, self.beancount_account(),
+                self.expenses, self.amount)
+        return templates['income'].format(
+            self.beancount_transaction_date(), self.payee, self.name,
+            self.tradeNo, self.trade_date, self.beancount_account(),
+            self.income)
 
 
 # ACCLog
 class AliAcclog(Transaction):
+    __slots__ = (
+        'tradeNo', 'dateString', 'datetime', 'time', 'name', 'remain',
+        'source', 'going', 'relate', 'record', 'manager',
+    )
+
     def __init__(self, row):
-        super(AliAcclog, self).__init__()
-        self.row = row
+        super(AliAcclog, self).__init__(row)
 
         # csv fields mapping
         self.tradeNo = row[0].strip()  # 流水号
         self.dateString = row[1].strip()  # 时间
-        dt = datetime.strptime(self.dateString, "%Y-%m-%d %H:%M:%S")
-        self.datetime = dt
-        self.time = dt.strftime("%H:%M:%S")
-        self.trade_date = dt.strftime("%Y-%m-%d")
+        self.datetime, self.trade_date, self.time = \
+            parse_iso_datetime(self.dateString)
 
         self.name = row[2].strip()  # 名称
         self.comment = row[3].strip()  # 备注
@@ -256,6 +337,7 @@ class AliAcclog(Transaction):
         self.remain = row[6].strip()  # 账户余额
         self.source = row[7].strip()  # 资金渠道
         self.going = None
+        self.parse_amounts()
 
         self.target = self.source
         self.relate = None
@@ -267,6 +349,9 @@ class AliAcclog(Transaction):
             return self.source + self.relate.source
         return self.source
 
+    def trade_datetime(self):
+        return self.datetime
+
     def is_alipay_source(self):
         return self.source == "支付宝"
 
@@ -276,65 +361,46 @@ class AliAcclog(Transaction):
     def is_income(self):
         return len(self.income) > 0
 
-    # combine
-    def is_looks_same(self, other):
-        if not _datetime_approximate(self, other):
-            return False
-
-        if not _amount_match(self.income, other.expenses):
-            return False
-
-        if not _amount_match(self.expenses, other.income):
-            return False
-
-        return True
-
     # beancount stuff
-    def postings(self):
-        chain_target = self.chain_target()
-        target_account = _beancount_account_for_source(chain_target)
+    def posting_lines(self):
+        """Two posting lines, without line breaks
+        """
         beancount_account = self.beancount_account()
         if self.link:
             beancount_account = self.link[0].beancount_account()
         alipay_account = _beancount_account_for_source("支付宝")
 
-        expenses_account = "! Expenses:Uncategorized"
-        if chain_target:
-            expenses_account = _beancount_account_for_source(chain_target)
-
         if self.is_income():
             if self.is_alipay_source():
                 # alipay => alipay
-                return (
-                        '  ! Income:Uncategorized -{1.income} CNY\n'
-                        '  {2} +{1.income} CNY'
-                    ).format(beancount_account, self, alipay_account)
+                return ('  ! Income:Uncategorized -' + self.income + ' CNY',
+                        '  ' + alipay_account + ' +' + self.income + ' CNY')
 
             # other source => alipay source
             if self.manager.link:
                 beancount_account = self.manager.link[0].beancount_account()
 
-            return (
-                '  {0} -{1.income} CNY\n'
-                '  {2} +{1.income} CNY'
-            ).format(beancount_account, self, alipay_account)
-        else:
-            exp = '+'+self.expenses.replace('-', '')
-            if self.is_alipay_source():
-                #  alipay source means expenses
-                return (
-                    '  {0} {1.expenses} CNY\n'
-                    '  {2} {3} CNY'
-                ).format(alipay_account, self, expenses_account, exp)
+            return ('  ' + beancount_account + ' -' + self.income + ' CNY',
+                    '  ' + alipay_account + ' +' + self.income + ' CNY')
+
+        exp = '+' + self.expenses.replace('-', '')
+        if self.is_alipay_source():
+            #  alipay source means expenses
+            chain_target = self.chain_target()
+            beancount_account = "! Expenses:Uncategorized"
+            if chain_target:
+                beancount_account = _beancount_account_for_source(chain_target)
+        # else 提现
 
-            return (  # 提现
-                '  {0} {1.expenses} CNY\n'
-                '  {2} {3} CNY'
-            ).format(alipay_account, self, beancount_account, exp)
+        return ('  ' + alipay_account + ' ' + self.expenses + ' CNY',
+                '  ' + beancount_account + ' ' + exp + ' CNY')
 
     def beancount_account(self):
         return _beancount_account_for_source(self.source)
 
+    def ledger_key(self):
+        return ('alipay acclog', self.tradeNo)
+
     def chain_target(self):
         if self.record:
             return self.record.payee
@@ -366,103 +432,112 @@ class AliAcclog(Transaction):
             ).format(assetTo, assetFrom, chain)
         return chain
 
-    def metadata(self):
-        chain = self.chain_info()
-        metadata = (
-            '  tradeNo:"{0.tradeNo}"\n'
-            '  trade_date:"{0.trade_date}"\n'
+    @classmethod
+    def build_templates(cls):
+        """Templates by (merged, show merged, show record, show linked),
+        fields are numbered automatically, in the order of the parts
+        """
+        head = (
+            '{} ' + Account.beancount_flags + ' "{}" "{}"\n'
+            '  tradeNo:"{}"\n'
+            '  trade_date:"{}"\n'
             '  bill:"alipay acclog"\n'
-            '  time:"{0.time}"\n'
-            '  comment:"{0.comment}"\n'
-            '  chain: "{1}"\n'
-        ).format(self, chain)
-
-        if Alipay.show_merged and self.relate:
-            merged = (
-                '; merged acclog:  \n'
-                ';  tradeNo: "{0.tradeNo}"\n'
-                ';  date:"{0.dateString}"\n'
-                ';  name: "{0.name}"\n'
-                ';  comment: "{0.comment}"\n'
-                ';  income:"+{0.income} CNY"\n'
-                ';  source:"{0.source}"\n'
-            ).format(self.relate)
-            metadata += merged
-
-        if Alipay.show_record and self.record:
-            record = (
-                '; merged record:\n'
-                ';  payee:"{0.payee}"\n'
-                ';  name:"{0.name}"\n'
-            ).format(self.record)
-            metadata += record
-
-        if Alipay.show_linked and self.link:
-            linked = (
-                '; linked transaction\n'
-                ';  account:"{0.account.name}"\n'
-                ';  income:"{0.income}"\n'
-                ';  expenses:"{0.expenses}"\n'
-            ).format(self.link[0])
-            metadata += linked
-        return metadata
-
-    def beancount_repr(self):
-        template = (
-            '{date} {flag} "{payee}" "{narration}"\n'
-            '{metadata}'
-            '{postings}'
+            '  time:"{}"\n'
+            '  comment:"{}"\n'
+            '  chain: "{}"\n'
         )
+        merged = (
+            '; merged acclog:  \n'
+            ';  tradeNo: "{}"\n'
+            ';  date:"{}"\n'
+            ';  name: "{}"\n'
+            ';  comment: "{}"\n'
+            ';  income:"+{} CNY"\n'
+            ';  source:"{}"\n'
+        )
+        record = (
+            '; merged record:\n'
+            ';  payee:"{}"\n'
+            ';  name:"{}"\n'
+        )
+        linked = (
+            '; linked transaction\n'
+            ';  account:"{}"\n'
+            ';  income:"{}"\n'
+            ';  expenses:"{}"\n'
+        )
+        # income posting lines of the merged acclog, then expenses lines
+        if Alipay.show_postings_mid:
+            merged_postings = '{}\n;{}\n;{}\n{} '
+        else:
+            merged_postings = '{}\n{} '
+        postings = '{}\n{}'
+
+        t = {}
+        for is_merged in (False, True):
+            for show_merged in (False, True):
+                for show_record in (False, True):
+                    for show_linked in (False, True):
+                        t[is_merged, show_merged, show_record, show_linked] = (
+                            head +
+                            (merged if show_merged else '') +
+                            (record if show_record else '') +
+                            (linked if show_linked else '') +
+                            (merged_postings if is_merged else postings)
+                        )
+        return t
 
-        d = {}
-        d['date'] = self.beancount_transaction_date()
-        d['flag'] = Account.beancount_flags
-        d['payee'] = self.chain_target() or ''
-        d['narration'] = ''
-        d['metadata'] = ''
-        d['postings'] = ''
-
-        metadata = self.metadata()
-
-        if self.relate:
-            ac1 = self
-            ac2 = self.relate
-            assetFrom = ac1 if ac1.is_income() else ac2
-            assetTo = ac1 if ac1.is_expanse() else ac2
-            assert(ac1 == assetTo)
-
-            d['narration'] = assetTo.name
-
-            postings = (
-                '{0}\n'
-                '{1} '
-            ).format(assetFrom.postings(), assetTo.postings())
-            d['postings'] = postings
-
-            lines = postings.splitlines(True)
-            assert(len(lines) == 4)
-
+    def beancount_repr(self):
+        relate = self.relate
+        record = self.record
+        link = self.link
+        show_merged = Alipay.show_merged and relate is not None
+        show_record = Alipay.show_record and record is not None
+        show_linked = Alipay.show_linked and bool(link)
+
+        fields = [self.beancount_transaction_date()]
+        if relate:
+            assert self.is_expanse()
+            fields.append(self.chain_target() or '')
+        else:
+            fields.append('')
+        fields += [self.name, self.tradeNo, self.trade_date, self.time,
+                   self.comment, self.chain_info()]
+
+        if show_merged:
+            fields += [relate.tradeNo, relate.dateString, relate.name,
+                       relate.comment, relate.income, relate.source]
+        if show_record:
+            fields += [record.payee, record.name]
+        if show_linked:
+            fields += [link[0].account.name, link[0].income,
+                       link[0].expenses]
+
+        if relate:
+            asset_from = self if self.is_income() else relate
+            from_lines = asset_from.posting_lines()
+            to_lines = self.posting_lines()
             if Alipay.show_postings_mid:
-                d['postings'] = (
-                    '{}'
-                    ';{}'
-                    ';{}'
-                    '{}'
-                    ).format(lines[0], lines[1], lines[2], lines[3])
+                fields += from_lines
+                fields += to_lines
             else:
-                d['postings'] = (
-                    '{}'
-                    '{}'
-                    ).format(lines[0], lines[3])
+                fields += [from_lines[0], to_lines[1]]
         else:
-            d['narration'] = self.name
-            d['payee'] = ''
-            d['postings'] = self.postings()
+            fields += self.posting_lines()
 
-        d['metadata'] = metadata
-        return template.format_map(d)
+        template = self.templates()[
+            relate is not None, show_merged, show_record, show_linked]
+        return template.format(*fields)
 
     # interface with other account
+    def similar_keys(self):
+        keys = [self.amount_keys()[0]]
+        if self.relate:
+            keys.append(_amount_key(self.relate.income_value))
+        if self.record:
+            keys.append(self.record.amount_keys()[0])
+        return keys
+
     def looks_like(self, t):
         if self.trade_date != t.trade_date:
             return False
@@ -496,10 +571,10 @@ class AliAcclog(Transaction):
 
         if self.income:
             if t.is_assets():
-                if _amount_match(self.income, t.expenses):
+                if _amount_match(self.income_value, t.expenses_value):
                     return True
             else:
-                if self.income == t.expenses:
+                if self.income_value == t.expenses_value:
                     return True
         else:
             pass
@@ -514,61 +589,175 @@ class AliAcclog(Transaction):
             if _amount_equal(t, record):
                 return True
         else:
-            if t.income == record.expenses and t.expenses == record.income:
+            if t.income_value == record.expenses_value and \
+               t.expenses_value == record.income_value:
                 return True
 
         return False
 
 
+_PAIR_WINDOW = timedelta(seconds=5)
+
+
+def _pair_key(t):
+    """(absolute amount, is income), by parsed values like _amount_match,
+    "-5.0" and "5.00" or "1,000.00" and "1000.00" have the same key
+    """
+    if t.income:
+        value = t.income_value
+        return (None if value is None else abs(value)), True
+    value = t.expenses_value
+    return (None if value is None else abs(value)), False
+
+
 class TransactionCombiner(object):
+    """Combine the two acclog rows of a transfer, the expenses from
+    Alipay and the income from the source, which are within 5 seconds.
+
+    Rows are pushed in csv order, which is ordered by time. Unpaired rows
+    wait in a window until a row more than 5 seconds away is pushed,
+    they are indexed by amount and side, so a row finds the nearest
+    matching row of the other side at once, even if other rows are
+    between them. Combined and single rows come out in csv order, made by
+    combine(), override it to make other results.
+    """
     def __init__(self):
         super(TransactionCombiner, self).__init__()
-        self.pendingRows = []
+        # [transaction, partner, key], in csv order
+        self.window = deque()
+        # (absolute amount, is income) => window entries not paired yet,
+        # in csv order
+        self.unpaired = {}
 
     def push_trans(self, trans):
-        self.pendingRows.append(trans)
-
-    def resolve(self):
-        if len(self.pendingRows) > 1:
-            ac1 = self.pendingRows[0]
-            ac2 = self.pendingRows[1]
-            if ac1.is_looks_same(ac2):
-                ac1.relate = ac2
-                ac2.manager = ac1
-                self.pendingRows = []
-                return ac1
-            else:
-                self.pendingRows.pop(0)
-                return ac1
+        """Push the next row, return results of rows which are done
+        """
+        done = []
+        window = self.window
+        unpaired = self.unpaired
+        dt = trans.datetime
+        while window:
+            entry = window[0]
+            if entry[1] is None:
+                if abs(entry[0].datetime - dt) <= _PAIR_WINDOW:
+                    break
+                # the oldest unpaired entry, first of its key
+                self._unindex(entry, 0)
+            entry = window.popleft()
+            done.append(self.combine(entry[0], entry[1]))
+
+        key = _pair_key(trans)
+        entry = self._take_partner(trans, key)
+        if entry is None:
+            entry = [trans, None, key]
+            window.append(entry)
+            entries = unpaired.get(key)
+            if entries is None:
+                entries = unpaired[key] = deque()
+            entries.append(entry)
+        else:
+            entry[1] = trans
+
+        while window and window[0][1] is not None:
+            entry = window.popleft()
+            done.append(self.combine(entry[0], entry[1]))
+        return done
+
+    def _take_partner(self, trans, key):
+        """Unindex and return the nearest unpaired entry of the other side
+        trans pairs with, None if not found
+        """
+        entries = self.unpaired.get((key[0], not key[1]))
+        if not entries:
+            return None
+        dt = trans.datetime
+        for i in range(len(entries) - 1, -1, -1):
+            other = entries[i][0]
+            if abs(other.datetime - dt) <= _PAIR_WINDOW and \
+               _amount_match(other.income_value, trans.expenses_value) and \
+               _amount_match(other.expenses_value, trans.income_value):
+                entry = entries[i]
+                self._unindex(entry, i)
+                return entry
+        return None
 
-    def final(self):
-        assert len(self.pendingRows) < 2
+    def _unindex(self, entry, i):
+        key = entry[2]
+        entries = self.unpaired[key]
+        if i == 0:
+            entries.popleft()
+        elif i == len(entries) - 1:
+            entries.pop()
+        else:
+            del entries[i]
+        if not entries:
+            del self.unpaired[key]
 
-        if len(self.pendingRows) > 0:
-            ac1 = self.pendingRows[0]
-            self.pendingRows.pop(0)
-            return self.single(ac1)
+    def final(self):
+        """Return results of rows left in the window
+        """
+        done = [self.combine(entry[0], entry[1]) for entry in self.window]
+        self.window.clear()
+        self.unpaired.clear()
+        return done
+
+    def combine(self, ac1, ac2):
+        """Result of row ac1, combined with row ac2 if not None
+        """
+        if ac2 is None:
+            return ac1
+
+        # the expenses row represents the transfer
+        if not ac1.is_expanse() and ac2.is_expanse():
+            ac1, ac2 = ac2, ac1
+        ac1.relate = ac2
+        ac2.manager = ac1
+        return ac1
 
 
 def main():
     argparser = argparse.ArgumentParser()
     argparser.add_argument(
         'csv',
-        help='CSV file of Alipay bills or directory that contains CSV files'
+        help=(
+            'CSV file of Alipay bills or directory that contains CSV files,\n'
+            '- to read from stdin')
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
+    stats.add_arguments(argparser)
     args = argparser.parse_args()
 
     csv = args.csv
     alipay = Alipay()
-    if os.path.isfile(csv):
-        alipay.load_csv_file(csv)
-    elif os.path.isdir(csv):
-        alipay.load_csv_directory(csv)
-    else:
-        print('Path not exist: ' + csv)
-        return 1
-    alipay.print_beancount_bills()
+    import_stats = ImportStats()
+    with stats.profiled(args.profile):
+        if csv == '-' or os.path.isfile(csv):
+            with import_stats.stage('parse', 'Alipay') as s:
+                if csv == '-':
+                    alipay.load_csv_data(open_csv_stream(sys.stdin.buffer))
+                else:
+                    alipay.load_csv_file(csv)
+                if alipay.is_acclog:
+                    alipay.merge_acclog()
+                    alipay.transactions = alipay.acclog_transactions
+                s.rows = len(alipay.transactions)
+        elif os.path.isdir(csv):
+            alipay.load_csv_directory(csv, stats=import_stats)
+        else:
+            print('Path not exist: ' + csv)
+            return 1
+
+        with import_stats.stage('output') as s:
+            with open_output(args.output) as out:
+                alipay.print_beancount_bills(out=out)
+            s.rows = len(alipay.transactions)
+
+    if args.stats:
+        import_stats.report()
 
 
 if __name__ == '__main__':
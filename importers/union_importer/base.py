@@ -3,36 +3,119 @@
 import csv
 import glob
 import os
-
-
-def guess_header_line(csv_data):
-    reader = csv.reader(csv_data)
-    minLen = 5
-    lineNum = 0
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from decimal import Decimal
+from decimal import InvalidOperation
+
+from csvfile import open_csv
+from stats import ImportStats
+from writer import BeancountWriter
+
+
+def sniff_csv_header(reader, minLen=5):
+    """Read rows until the table header, which is the first row has at
+    least minLen fields. Return (rows before header, header row), header
+    row is None if not found. The reader is left at the table body, so
+    the file is read only once and works with pipes.
+    """
+    prefix = []
     for row in reader:
         if len(row) >= minLen:
-            break
-        lineNum += 1
+            return prefix, row
+        prefix.append(row)
 
-    return lineNum
+    return prefix, None
 
 
-def csv_seek_to_header(csv_data):
-    lineNum = guess_header_line(csv_data)
-    csv_data.seek(0)
+def parse_amount(amount):
+    """Parse an amount string to Decimal, empty amount is 0.
+    None means the amount is not a number
+    """
+    if not amount:
+        return Decimal(0)
+    try:
+        return Decimal(amount.replace(',', ''))
+    except InvalidOperation:
+        return None
 
-    if lineNum == 0:
-        return
 
-    reader = csv.reader(csv_data)
-    while lineNum > 0:
-        next(reader)
-        lineNum -= 1
+def _amount_key(value):
+    """Absolute value of a parsed amount, used to bucket candidates.
+    None means the amount matches any bucket
+    """
+    if value is None:
+        return None
+    return abs(value)
+
+
+class SimilarIndex(object):
+    """Buckets transactions of one account by (trade_date, amount key)
+
+    looks_like always requires same trade_date and an amount relation,
+    so only transactions in the same bucket need to be compared.
+    """
+    def __init__(self, transactions):
+        super(SimilarIndex, self).__init__()
+        self.lookers = defaultdict(list)
+        self.targets = defaultdict(list)
+        self.by_date = defaultdict(list)
+
+        for pos, t in enumerate(transactions):
+            entry = (pos, t)
+            self.by_date[t.trade_date].append(entry)
+            for k in set(t.similar_keys()):
+                self.lookers[(t.trade_date, k)].append(entry)
+            for k in set(t.amount_keys()):
+                self.targets[(t.trade_date, k)].append(entry)
+
+    def _collect(self, buckets, date, keys, found):
+        if None in keys:
+            for pos, t in self.by_date.get(date, ()):
+                found[pos] = t
+            return
+        for k in keys + (None,):
+            for pos, t in buckets.get((date, k), ()):
+                found[pos] = t
+
+    def candidates(self, ot):
+        """Transactions which may looks like ot, in original order"""
+        found = {}
+        date = ot.trade_date
+        self._collect(self.lookers, date, tuple(ot.amount_keys()), found)
+        self._collect(self.targets, date, tuple(ot.similar_keys()), found)
+        return [found[pos] for pos in sorted(found)]
+
+
+# beancount_repr templates, by transaction type and output flags
+_templates = {}
+
+
+def _load_csv_file(cls, path, stats=None):
+    """Process pool worker, parse one csv file into a new cls account
+    """
+    account = cls()
+    account.stats = stats
+    account.load_csv_file(path)
+    # not pickled with the account
+    account.stats = None
+    return account
+
+
+def write_beancount_bills(transactions, out=None):
+    writer = BeancountWriter(out)
+    writer.write_all(transactions)
+    return writer.count
 
 
 class Account(object):
     folder_name = ""
 
+    # other names of the account, which may appear in descriptions of
+    # transactions in other accounts
+    aliases = ()
+
     # output control
     show_merged = False
     show_record = False
@@ -40,18 +123,70 @@ class Account(object):
     show_postings_mid = False
     beancount_flags = "!"
 
+    # keep the raw csv row in transactions, only useful for debugging
+    keep_rows = False
+
+    # search similar transactions with columns.ColumnarSimilarIndex
+    columnar = False
+
+    @classmethod
+    def output_flags(cls):
+        return (cls.beancount_flags, cls.show_merged, cls.show_record,
+                cls.show_linked, cls.show_postings_mid)
+
     def __init__(self):
         super(Account, self).__init__()
         self.transactions = []
         self.name = type(self)
+        self.similar_index = None
+        # stats.ImportStats of load_csv_directory, sub-stages of loading
+        # are timed while it is set
+        self.stats = None
+
+    def timed(self, name):
+        """Context timing sub-stage name of the running stage, if stats
+        are recorded
+        """
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.timed(name)
 
     # csv loading
-    def parser_csv(self, csv_data):
-        csv_seek_to_header(csv_data)
+    def iter_csv(self, csv_data):
+        """Parse csv_data and yield transactions one by one,
+        self.transactions is left untouched
+        """
         reader = csv.reader(csv_data)
-
-        next(reader)  # skip header
-        for row in reader:
+        with self.timed('sniff') as s:
+            prefix, header = sniff_csv_header(reader)
+            self.header_sniffed(prefix, header)
+            if s is not None:
+                s.rows += 1
+        if header is None:
+            return
+
+        if self.stats is None:
+            for t in self.iter_rows(reader):
+                yield t
+            return
+
+        # reading and parsing rows, not the time of the consumer
+        s = self.stats.sub_stage('parser_row')
+        clock = time.perf_counter
+        rows = self.iter_rows(reader)
+        while True:
+            start = clock()
+            t = next(rows, None)
+            s.seconds += clock() - start
+            if t is None:
+                return
+            s.rows += 1
+            yield t
+
+    def iter_rows(self, rows):
+        """Parse rows of table body and yield transactions
+        """
+        for row in rows:
             if self.row_is_endmark(row):
                 break
             if not self.row_valided(row):
@@ -59,22 +194,111 @@ class Account(object):
             t = self.parser_row(row)
             if t:
                 t.account = self
-                self.transactions.append(t)
+                yield t
+
+    def iter_csv_file(self, path):
+        with open_csv(path) as csv_data:
+            for t in self.iter_csv(csv_data):
+                yield t
+
+    def parser_csv(self, csv_data):
+        self.transactions.extend(self.iter_csv(csv_data))
 
     def load_csv_data(self, csv_data):
         self.parser_csv(csv_data)
 
     def load_csv_file(self, path):
-        csv_data = open(path)
+        csv_data = open_csv(path)
         self.load_csv_data(csv_data)
         csv_data.close()
 
-    def load_csv_directory(self, path):
-        for f in glob.glob(os.path.join(path, "*.csv")):
-            self.load_csv_file(f)
+    def csv_files(self, path):
+        files = glob.glob(os.path.join(path, "*.csv"))
+        files.extend(glob.glob(os.path.join(path, "*.csv.gz")))
+        return sorted(files)
 
+    def load_csv_files(self, files, executor=None, cache=None):
+        """Load csv files in order, parse them in executor's worker
+        processes if provided, files found in cache are not parsed
+        """
+        if executor is None and cache is None:
+            for f in files:
+                self.load_csv_file(f)
+            return
+
+        cls = type(self)
+        cached = [cache.lookup(cls, f) if cache else None for f in files]
+        missing = [f for f, loaded in zip(files, cached) if loaded is None]
+        # before parsing, files may change meanwhile
+        fingerprints = {}
+        if cache:
+            for f in missing:
+                fingerprints[f] = cache.fingerprint(f)
+        if executor is None:
+            parsed = (_load_csv_file(cls, f, self.stats) for f in missing)
+        else:
+            parsed = executor.map(_load_csv_file, [cls] * len(missing), missing)
+
+        for f, loaded in zip(files, cached):
+            if loaded is None:
+                loaded = next(parsed)
+                if cache:
+                    cache.store(cls, f, loaded, fingerprints[f])
+            self.merge_loaded(loaded)
+
+    def merge_loaded(self, other):
+        """Take over transactions an account loaded in a worker process
+        """
+        for t in other.transactions:
+            t.account = self
+            self.transactions.append(t)
+
+    def load_csv_directory(self, path, executor=None, cache=None,
+                           stats=None):
+        if stats is None:
+            stats = ImportStats()
+        name = type(self).__name__
+
+        with stats.stage('discover', name) as s:
+            files = self.csv_files(path)
+            s.rows = len(files)
+
+        self.stats = stats
+        try:
+            with stats.stage('parse', name) as s:
+                self.load_csv_files(files, executor, cache)
+                s.rows = self.loaded_rows()
+
+            with stats.stage('merge', name) as s:
+                self.finish_loading()
+                s.rows = len(self.transactions)
+                s.matched, s.unmatched = self.merge_counts()
+        finally:
+            self.stats = None
+
+    def finish_loading(self):
+        """Called after all csv files loaded, merge and sort
+        self.transactions
+        """
         self.transactions.sort(key=lambda t: t.trade_date)
 
+    def loaded_rows(self):
+        """Number of transactions loaded from csv files
+        """
+        return len(self.transactions)
+
+    def merge_counts(self):
+        """(matched, unmatched) rows of finish_loading, None if nothing
+        is merged
+        """
+        return None, None
+
+    def header_sniffed(self, prefix, header):
+        """Called with rows before the table header and the header row
+        before parsing table body, override to detect csv file type
+        """
+        pass
+
     def row_valided(self, row):
         if len(row) == 0:
             return False
@@ -92,15 +316,41 @@ class Account(object):
         return None
 
     # output
-    def print_beancount_bills(self):
-        for t in self.transactions:
-            print(t.beancount_repr())
-            print("\n")
+    def print_beancount_bills(self, transactions=None, out=None):
+        """Print self.transactions, or transactions from an iterator
+        such as iter_csv_file without keeping them in memory
+        """
+        if transactions is None:
+            transactions = self.transactions
+        return write_beancount_bills(transactions, out)
 
     # transaction linking
+    def keywords(self):
+        """Names of the account to search in descriptions of other
+        accounts' transactions, see Resolver.possible_accounts
+        """
+        return [self.name] + list(self.aliases)
+
+    def build_similar_index(self, store=None, transactions=None):
+        """Index transactions for search_similar, call again after
+        self.transactions changed. Given a columns.ColumnStore of all
+        accounts, candidates are searched with arrays. Given
+        transactions, a part of self.transactions, only they are indexed
+        """
+        if store is not None:
+            self.similar_index = store.similar_index(self)
+        elif transactions is not None:
+            self.similar_index = SimilarIndex(transactions)
+        else:
+            self.similar_index = SimilarIndex(self.transactions)
+
     def search_similar(self, ot):
+        candidates = self.transactions
+        if self.similar_index:
+            candidates = self.similar_index.candidates(ot)
+
         lk = []
-        for t in self.transactions:
+        for t in candidates:
             if t.looks_like(ot) or ot.looks_like(t):
                 lk.append(t)
 
@@ -109,26 +359,93 @@ class Account(object):
         return None
 
 
+# attributes of transactions refer to other transactions
+REFERENCES = ('relate', 'record', 'acclog', 'manager')
+
+# value attributes by transaction type
+_value_slots = {}
+
+
+def value_slots(cls):
+    """Names of the __slots__ of cls and its bases holding values of the
+    transaction itself, references, links and the account left out
+    """
+    names = _value_slots.get(cls)
+    if names is None:
+        skipped = REFERENCES + ('link', 'account')
+        names = []
+        for c in reversed(cls.__mro__):
+            for name in c.__dict__.get('__slots__', ()):
+                if name not in skipped:
+                    names.append(name)
+        _value_slots[cls] = names
+    return names
+
+
 class Transaction(object):
-    def __init__(self):
+    # there can be lots of transactions, save memory of __dict__,
+    # subclasses should declare __slots__ for their own attributes
+    __slots__ = (
+        'trade_date', 'settled_date', 'income', 'expenses', 'amount',
+        'income_value', 'expenses_value', 'comment', 'payee', 'target',
+        'link', 'account', 'row',
+    )
+
+    def __init__(self, row=None):
         super(Transaction, self).__init__()
+        self.row = row if Account.keep_rows else None
         self.trade_date = None
         self.settled_date = None
         self.income = None
         self.expenses = None
         self.amount = None
+        self.income_value = Decimal(0)
+        self.expenses_value = Decimal(0)
 
         self.comment = None
         self.payee = None
         self.target = None
         self.link = []
 
+    def parse_amounts(self):
+        """Call once income and expenses strings are set, the parsed
+        values are used for matching, the strings for output
+        """
+        self.income_value = parse_amount(self.income)
+        self.expenses_value = parse_amount(self.expenses)
+
     # transaction linking
     def looks_like(self, t):
         """Override to determine if a transaction in other account is same with self
         """
         return False
 
+    def similar_keys(self):
+        """Override together with looks_like, return amount keys that
+        a transaction must have in amount_keys to looks like self
+        """
+        return ()
+
+    def amount_keys(self):
+        income = _amount_key(self.income_value)
+        expenses = _amount_key(self.expenses_value)
+        if income is None or expenses is None:
+            return (None,)
+        return (income + expenses, income, expenses)
+
+    def trade_datetime(self):
+        """Override to return the datetime of the trade, similar
+        transactions which look like more than one are paired by it
+        """
+        return None
+
+    def ledger_key(self):
+        """Override to return the key of the transaction in a beancount
+        ledger, made from the metadata written by beancount_repr,
+        see ledger.entry_key
+        """
+        return None
+
     def is_assets(self):
         """Subclass can override this method
         return False if it is a credit card
@@ -150,6 +467,24 @@ class Transaction(object):
         return self.beancount_transaction_date()
 
     # output
+    @classmethod
+    def templates(cls):
+        """Templates of beancount_repr, made by build_templates once for
+        each set of output flags
+        """
+        key = (cls, Account.output_flags())
+        templates = _templates.get(key)
+        if templates is None:
+            templates = _templates[key] = cls.build_templates()
+        return templates
+
+    @classmethod
+    def build_templates(cls):
+        """Override to return format strings used by beancount_repr,
+        output flags of Account can be read here
+        """
+        return {}
+
     def beancount_account(self):
         return self.account.beancount_account
 
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+'''Generate synthetic bills for benchmarks
+
+usage: ./generate.py directory N [--seed SEED] [--days DAYS]
+
+Creates alipay/ (acclog and record), cmb_credit/ and cmb_debit/ monthly
+csv statements with about N transactions in total, like the bills
+directory of union_importer.py. Some of them are related the way real
+bills are: paying with the credit card through Alipay, withdrawing from
+Alipay to the debit card, and repeated payments of the same amount.
+'''
+
+import argparse
+import csv
+import os
+import random
+from datetime import datetime
+from datetime import timedelta
+
+
+ACCLOG_HEAD = [
+    ['#支付宝收支明细查询'],
+    ['#账号:[20880000000000000156]'],
+    ['#起始日期:[{start}]    终止日期:[{end}]'],
+    ['#---------------------------------收支明细列表----------------------------'],
+    ['流水号', '时间', '名称', '备注', '收入', '支出', '账户余额（元）', '资金渠道'],
+]
+ACCLOG_TAIL = [
+    ['#-------------------------------------------------------------------------'],
+    ['#导出时间:[{end}]'],
+]
+
+RECORD_HEAD = [
+    ['支付宝交易记录明细查询'],
+    ['账号:[20880000000000000156]'],
+    ['起始日期:[{start}]    终止日期:[{end}]'],
+    ['---------------------------------交易记录明细列表------------------------------------'],
+    ['交易号', '商户订单号', '交易创建时间', '付款时间', '最近修改时间', '交易来源地',
+     '类型', '交易对方', '商品名称', '金额（元）', '收/支', '交易状态',
+     '服务费（元）', '成功退款（元）', '备注', '资金状态'],
+]
+RECORD_TAIL = [
+    ['------------------------------------------------------------------------------------'],
+    ['导出时间:[{end}]'],
+]
+
+CREDIT_HEAD = [
+    ['\t对账标志', '\t交易日期', '\t记账日期', '\t交易摘要', '\t卡号后四位',
+     '\t人民币金额', '\t消费类别', '\t备注'],
+]
+
+DEBIT_HEAD = [
+    ['# 招商银行交易记录'],
+    ['# 导出时间: [            {end}]'],
+    ['# 起始日期: [{start}]   终止日期: [{end}]'],
+    [],
+    ['交易时间', '收支', '余额', '交易类型', '交易备注'],
+]
+DEBIT_TAIL = [
+    [],
+    ['# 导出完毕'],
+]
+
+PAYEES = ['淘宝', '美团', '地铁', '天弘基金', '星巴克', '京东']
+SHOPS = ['XX餐厅', 'AMAZON', 'DIGITALOCEAN.COM', '支付宝（ 95188 ）']
+# repeated amounts, subway fares and coffee
+COMMON_AMOUNTS = ['2.00', '3.00', '15.50', '99.00']
+
+
+class BillsGenerator(object):
+    def __init__(self, seed=1):
+        super(BillsGenerator, self).__init__()
+        self.rnd = random.Random(seed)
+        self.bills = {
+            'acclog': [],
+            'record': [],
+            'credit': [],
+            'debit': [],
+        }
+        self.serial = 0
+
+    def _amount(self):
+        if self.rnd.random() < 0.4:
+            return self.rnd.choice(COMMON_AMOUNTS)
+        return '{}.{:02d}'.format(self.rnd.randint(1, 999), self.rnd.randint(0, 99))
+
+    def _add(self, bill, dt, row):
+        """dt of the event decides the monthly statement of the row
+        """
+        self.bills[bill].append((dt, len(self.bills[bill]), row))
+
+    def _trade_no(self, dt):
+        self.serial += 1
+        return '{:%Y%m%d}2{:011d}'.format(dt, self.serial)
+
+    def _record(self, dt, ds, amount, payee, name, income=False):
+        self._add('record', dt, [
+            self._trade_no(dt), 'T{}'.format(self.serial), ds, ds, ds, '其他',
+            '即时到账交易', payee, name, amount, '收入' if income else '支出',
+            '交易成功', '0.00', '0.00', '', '已收入' if income else '已支出',
+        ])
+
+    def _debit(self, dt, amount, category, comment):
+        self._add('debit', dt, [
+            '\t{:%Y%m%d  %H:%M:%S}'.format(dt), '\t' + amount, '1,000.00',
+            category, '\t' + comment,
+        ])
+
+    def _credit(self, dt, payee, amount):
+        settled = dt + timedelta(days=self.rnd.randint(0, 2))
+        self._add('credit', dt, [
+            '\t未确认', '\t{:%Y-%m-%d}'.format(dt), '\t{:%Y-%m-%d}'.format(settled),
+            '\t' + payee, '\t' + self.rnd.choice(['1111', '2222', '3333']),
+            '\t' + amount, '\t', '\t',
+        ])
+
+    def event(self, dt):
+        rnd = self.rnd
+        ds = '{:%Y-%m-%d %H:%M:%S}'.format(dt)
+        amount = self._amount()
+        payee = rnd.choice(PAYEES)
+        name = '商品{}'.format(self.serial)
+        kind = rnd.random()
+
+        if kind < 0.3:
+            # pay with credit card through alipay, two acclog rows
+            trade_no = self._trade_no(dt)
+            charged = dt - timedelta(seconds=rnd.randint(0, 5))
+            self._add('acclog', dt, [
+                trade_no, ds, name, '', '', '-' + amount, '0.00', '支付宝'])
+            self._add('acclog', dt, [
+                self._trade_no(dt), '{:%Y-%m-%d %H:%M:%S}'.format(charged),
+                '充值', '', amount, '', amount, '招商银行'])
+            self._add('record', dt, [
+                trade_no, 'T{}'.format(self.serial), ds, ds, ds, '其他',
+                '即时到账交易', payee, name, amount, '支出', '交易成功',
+                '0.00', '0.00', '', '已支出'])
+            self._credit(dt, '支付宝（ 95188 ）', amount)
+        elif kind < 0.5:
+            # pay with alipay balance
+            trade_no = self._trade_no(dt)
+            self._add('acclog', dt, [
+                trade_no, ds, name, '', '', '-' + amount, '10.00', '支付宝'])
+            self._add('record', dt, [
+                trade_no, 'T{}'.format(self.serial), ds, ds, ds, '其他',
+                '即时到账交易', payee, name, amount, '支出', '交易成功',
+                '0.00', '0.00', '', '已支出'])
+        elif kind < 0.6:
+            # withdraw to debit card
+            self._add('acclog', dt, [
+                self._trade_no(dt), ds, '提现', '', '', '-' + amount, '0.00',
+                '招商银行'])
+            self._debit(dt, amount, '银联入账', '支付宝提现')
+        elif kind < 0.7:
+            self._record(dt, ds, amount, payee, '收款', income=True)
+        elif kind < 0.85:
+            if rnd.random() < 0.1:
+                amount = '-' + amount  # refund
+            self._credit(dt, rnd.choice(SHOPS), amount)
+        else:
+            sign = rnd.choice(['', '-'])
+            self._debit(dt, sign + amount, rnd.choice(['代发工资', '消费']),
+                        '备注{}'.format(self.serial))
+
+    def generate(self, n, days):
+        start = datetime(2016, 1, 1)
+        seconds = days * 86400
+        times = sorted(self.rnd.randrange(seconds) for _ in range(n))
+        for s in times:
+            self.event(start + timedelta(seconds=s))
+
+    def write(self, directory):
+        _write_bills(directory, 'alipay', 'acclog', self.bills['acclog'],
+                     ACCLOG_HEAD, ACCLOG_TAIL, newest_first=True)
+        _write_bills(directory, 'alipay', 'record', self.bills['record'],
+                     RECORD_HEAD, RECORD_TAIL, newest_first=True)
+        _write_bills(directory, 'cmb_credit', 'credit', self.bills['credit'],
+                     CREDIT_HEAD, [], newest_first=False)
+        _write_bills(directory, 'cmb_debit', 'debit', self.bills['debit'],
+                     DEBIT_HEAD, DEBIT_TAIL, newest_first=True)
+
+
+def _format_rows(rows, start, end):
+    return [[f.format(start=start, end=end) for f in row] for row in rows]
+
+
+def _write_bills(directory, folder, name, rows, head, tail, newest_first):
+    path = os.path.join(directory, folder)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    months = {}
+    for dt, pos, row in rows:
+        months.setdefault((dt.year, dt.month), []).append((dt, pos, row))
+
+    for (year, month), month_rows in sorted(months.items()):
+        # rows of an event keep their order
+        month_rows.sort(key=lambda x: (x[0], -x[1] if newest_first else x[1]),
+                        reverse=newest_first)
+        start = '{}-{:02d}-01 00:00:00'.format(year, month)
+        end = '{:%Y-%m-%d %H:%M:%S}'.format(month_rows[0 if newest_first else -1][0])
+        filename = os.path.join(
+            path, '{}_{}{:02d}.csv'.format(name, year, month))
+        with open(filename, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerows(_format_rows(head, start, end))
+            writer.writerows(row for dt, pos, row in month_rows)
+            writer.writerows(_format_rows(tail, start, end))
+
+
+def generate(directory, n, seed=1, days=None):
+    if days is None:
+        days = max(30, n // 50)
+    g = BillsGenerator(seed)
+    g.generate(n, days)
+    g.write(directory)
+    return dict((k, len(v)) for k, v in g.bills.items())
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('directory', help='bills directory to create')
+    argparser.add_argument('n', type=int, help='number of transactions')
+    argparser.add_argument('--seed', type=int, default=1)
+    argparser.add_argument(
+        '--days', type=int,
+        help='days the bills span, default is 50 transactions a day'
+    )
+    args = argparser.parse_args()
+
+    rows = generate(args.directory, args.n, args.seed, args.days)
+    print(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+'''Memory used per transaction, with and without __slots__ and raw rows
+
+usage: ./memory.py [N]
+'''
+
+import csv
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from base import Account  # noqa: E402
+from alipay import AliAcclog, AliRecord  # noqa: E402
+from cmb_credit import CMBTransaction  # noqa: E402
+from cmb_debit import CMBDebitTransaction  # noqa: E402
+
+
+SAMPLE_LINES = {
+    AliRecord: (
+        '2016{0:012d},O{0},2016-02-01 12:{1:02d}:00,2016-02-01 12:{1:02d}:00,'
+        '2016-02-01 12:{1:02d}:00,其他,即时到账交易,淘宝,商品{0},99.00,支出,'
+        '交易成功,0.00,0.00,,已支出'
+    ),
+    AliAcclog: (
+        '2016{0:012d},2016-02-01 12:{1:02d}:00,商品{0},,,-99.00,10.00,支付宝'
+    ),
+    CMBTransaction: (
+        '\t未确认,\t2016-02-01,\t2016-02-03,\tXX餐厅{0},\t1111,\t99.00,\t,\t'
+    ),
+    CMBDebitTransaction: (
+        '\t20160201  12:{1:02d}:00,\t-500.00,1000.00,银联入账,\t备注{0}'
+    ),
+}
+
+
+def _slot_names(cls):
+    names = []
+    for c in reversed(cls.__mro__):
+        names.extend(c.__dict__.get('__slots__', ()))
+    return names
+
+
+def measure(cls, template, n, keep_rows):
+    lines = [template.format(i, i % 60) for i in range(n)]
+    Account.keep_rows = keep_rows
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    transactions = [cls(row) for row in csv.reader(lines)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    del transactions
+    return used / n
+
+
+def measure_dict(cls, template, n):
+    """Same attributes and row in the __dict__ of a class without
+    __slots__ anywhere in its bases, the layout before __slots__
+    """
+    lines = [template.format(i, i % 60) for i in range(n)]
+    Account.keep_rows = True
+    names = _slot_names(cls)
+    plain = type(cls.__name__, (object,), {})
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    transactions = []
+    for row in csv.reader(lines):
+        t = cls(row)
+        d = plain()
+        for name in names:
+            if hasattr(t, name):
+                setattr(d, name, getattr(t, name))
+        transactions.append(d)
+    # the slotted transaction is freed, its values are kept by d
+    del t
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    del transactions
+    return used / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('bytes per transaction, {} transactions'.format(n))
+    print('{:<22}{:>16}{:>10}{:>16}'.format(
+        '', '__dict__+row', '__slots__', '__slots__+row'))
+    for cls, template in SAMPLE_LINES.items():
+        before = measure_dict(cls, template, n)
+        after = measure(cls, template, n, False)
+        with_rows = measure(cls, template, n, True)
+        print('{:<22}{:>16.0f}{:>10.0f}{:>16.0f}'.format(
+            cls.__name__, before, after, with_rows))
+    Account.keep_rows = False
+
+
+if __name__ == '__main__':
+    main()
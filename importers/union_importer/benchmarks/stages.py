@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+'''Time every stage of union_importer on synthetic bills
+
+usage: ./stages.py [--sizes 1000,10000,100000] [-o benchmark.json]
+
+For each size, bills are generated with generate.py into a temporary
+directory and imported with the loaders of union_importer, which time
+their stages with stats.ImportStats: discover, parse and merge of every
+account, with the header sniffing, parser_row, merge_acclog and
+merge_acclog_and_record sub-stages, then Resolver.resolve and rendering.
+Seconds of every stage, named like parse.Alipay or parser_row.Alipay,
+and row counts are written as JSON, so results can be compared between
+commits.
+'''
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from base import write_beancount_bills  # noqa: E402
+from stats import ImportStats  # noqa: E402
+from union_importer import Resolver  # noqa: E402
+from union_importer import load_accounts  # noqa: E402
+
+from generate import generate  # noqa: E402
+
+
+def _stage_seconds(import_stats):
+    seconds = {}
+    for stage in import_stats.stages:
+        name = stage.name
+        if stage.account:
+            name += '.' + stage.account
+        seconds[name] = seconds.get(name, 0.0) + stage.seconds
+    return seconds
+
+
+def run(directory):
+    import_stats = ImportStats()
+    accounts = load_accounts(directory, stats=import_stats)
+
+    with import_stats.stage('resolve'):
+        results = Resolver(accounts).resolve()
+
+    out = io.StringIO()
+    with import_stats.stage('render'):
+        write_beancount_bills(results, out)
+
+    return {
+        'stages': _stage_seconds(import_stats),
+        'transactions': dict(
+            (type(a).__name__, len(a.transactions)) for a in accounts),
+        'results': len(results),
+        'output_bytes': len(out.getvalue().encode('utf-8')),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--sizes', default='1000,10000',
+        help='comma separated numbers of transactions, default 1000,10000'
+    )
+    argparser.add_argument('--seed', type=int, default=1)
+    argparser.add_argument(
+        '-o', '--output', default='benchmark.json',
+        help='JSON file to write results, - for stdout'
+    )
+    args = argparser.parse_args()
+
+    report = {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'runs': [],
+    }
+    for size in [int(x) for x in args.sizes.split(',')]:
+        directory = tempfile.mkdtemp(prefix='bills_')
+        try:
+            rows = generate(directory, size, args.seed)
+            result = run(directory)
+        finally:
+            shutil.rmtree(directory)
+
+        result['size'] = size
+        result['rows'] = rows
+        report['runs'].append(result)
+        print('{:>8} {}'.format(size, ' '.join(
+            '{}={:.3f}s'.format(k, v) for k, v in result['stages'].items())),
+            file=sys.stderr)
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+'''Time the startup of union_importer
+
+usage: ./startup.py [--repeat 20] [-o startup.json]
+
+Every case is a fresh python process, the median of some runs is
+reported. "import" only imports union_importer, "import all importers"
+also imports every module of registry.py, which is what startup cost
+before importers were imported lazily. The run cases import a small
+bills directory which has one folder, or all of them.
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(HERE, '..')
+sys.path.insert(0, SOURCE)
+
+import registry  # noqa: E402
+
+from generate import generate  # noqa: E402
+
+
+def _time_process(argv, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call(
+            argv, cwd=SOURCE, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def _python_code(code):
+    return [sys.executable, '-c', code]
+
+
+def run(directory, repeat):
+    """Median seconds of every case
+    """
+    modules = ', '.join(module for _, module, _ in registry.IMPORTERS)
+    one = os.path.join(directory, 'one')
+    everything = os.path.join(directory, 'all')
+    generate(everything, 100)
+    os.makedirs(one)
+    folder = registry.folder_names()[-1]
+    shutil.copytree(
+        os.path.join(everything, folder), os.path.join(one, folder))
+
+    cases = (
+        ('python', _python_code('pass')),
+        ('import', _python_code('import union_importer')),
+        ('import all importers',
+            _python_code('import union_importer, ' + modules)),
+        ('run one folder',
+            [sys.executable, 'union_importer.py', one]),
+        ('run all folders',
+            [sys.executable, 'union_importer.py', everything]),
+    )
+    return dict((name, _time_process(argv, repeat)) for name, argv in cases)
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--repeat', type=int, default=20,
+        help='runs of every case, the median is reported, default 20'
+    )
+    argparser.add_argument(
+        '-o', '--output', default='startup.json',
+        help='JSON file to write results, - for stdout'
+    )
+    args = argparser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bills_')
+    try:
+        seconds = run(directory, args.repeat)
+    finally:
+        shutil.rmtree(directory)
+
+    for name, s in seconds.items():
+        print('{:<22} {:.1f}ms'.format(name, s * 1000), file=sys.stderr)
+
+    report = {
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'seconds': seconds,
+    }
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
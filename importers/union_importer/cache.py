@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+'''Cache of parsed csv files, so unchanged statements are not parsed again
+
+Parsed files are pickled into a SQLite database, keyed by account type
+and file path. An entry is used when the file size and mtime are the
+same, or when the file was only touched and its content hash is the
+same. Entries written by other importer code or options are ignored.
+
+Loading a pickle can run code, so the database of a bills directory is
+kept in the cache directory of the user, not in the bills directory,
+which may be shared or synced with other people.
+'''
+
+import glob
+import hashlib
+import importlib.util
+import os
+import pickle
+import sqlite3
+
+from base import Account
+import registry
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_files():
+    """union_importer sources, and the parser modules of the registry
+    which may be somewhere else on sys.path
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    files = set(glob.glob(os.path.join(here, "*.py")))
+    for _, module, _ in registry.IMPORTERS:
+        spec = importlib.util.find_spec(module)
+        if spec is not None and spec.origin:
+            files.add(os.path.abspath(spec.origin))
+    return sorted(files)
+
+
+def _code_version():
+    """Digest of the importer sources and options affect parsing
+    """
+    digest = hashlib.sha1()
+    for f in _source_files():
+        with open(f, 'rb') as src:
+            digest.update(src.read())
+    digest.update(repr(Account.keep_rows).encode())
+    return digest.hexdigest()
+
+
+def cache_directory():
+    """Cache directory of the user, $XDG_CACHE_HOME/union_importer
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'union_importer')
+
+
+class ParsedCache(object):
+    def __init__(self, path):
+        super(ParsedCache, self).__init__()
+        self.path = path
+        self.version = _code_version()
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS parsed ('
+            ' account TEXT, path TEXT, size INTEGER, mtime INTEGER,'
+            ' digest TEXT, version TEXT, data BLOB,'
+            ' PRIMARY KEY (account, path))'
+        )
+
+    @classmethod
+    def for_directory(cls, directory):
+        """Cache of a bills directory, in cache_directory()
+        """
+        name = hashlib.sha1(
+            os.path.abspath(directory).encode('utf-8')).hexdigest()
+        path = cache_directory()
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return cls(os.path.join(path, name + '.sqlite'))
+
+    def _key(self, account_cls, path):
+        return account_cls.__name__, os.path.abspath(path)
+
+    def lookup(self, account_cls, path):
+        """Return the account loaded from path before, or None
+        """
+        key = self._key(account_cls, path)
+        row = self.db.execute(
+            'SELECT size, mtime, digest, version, data FROM parsed'
+            ' WHERE account = ? AND path = ?', key
+        ).fetchone()
+        if not row:
+            return None
+
+        size, mtime, digest, version, data = row
+        if version != self.version:
+            return None
+
+        st = os.stat(path)
+        if st.st_size != size:
+            return None
+        if st.st_mtime_ns != mtime:
+            # touched only?
+            if _file_digest(path) != digest:
+                return None
+            self.db.execute(
+                'UPDATE parsed SET mtime = ? WHERE account = ? AND path = ?',
+                (st.st_mtime_ns,) + key
+            )
+
+        return pickle.loads(data)
+
+    def fingerprint(self, path):
+        """(size, mtime, digest) of path, taken before path is parsed, so
+        a write during parsing makes the entry stale
+        """
+        # digest first, a write after it changes size or mtime
+        digest = _file_digest(path)
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns, digest
+
+    def store(self, account_cls, path, loaded, fingerprint):
+        """Store the account loaded from path, fingerprint is taken
+        before parsing
+        """
+        data = pickle.dumps(loaded, pickle.HIGHEST_PROTOCOL)
+        self.db.execute(
+            'INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self._key(account_cls, path) + fingerprint + (self.version, data)
+        )
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -10,6 +10,10 @@ import os
 
 from base import Account
 from base import Transaction
+from csvfile import open_csv_stream
+import stats
+from stats import ImportStats
+from writer import open_output
 
 
 # 招商银行 信用卡
@@ -28,9 +32,10 @@ class CMBCreditCard(Account):
 
 
 class CMBTransaction(Transaction):
+    __slots__ = ('card_last_digit', 'category')
+
     def __init__(self, row):
-        super(CMBTransaction, self).__init__()
-        self.row = row
+        super(CMBTransaction, self).__init__(row)
 
         self.trade_date = row[1].strip()  # 交易日期
         self.payee = row[3].strip().replace('"', '')  # 交易摘要
@@ -46,6 +51,7 @@ class CMBTransaction(Transaction):
         self.card_last_digit = row[4].strip()  # 卡号后四位
         self.category = row[6].strip()  # 消费类别
         self.comment = row[7].strip()  # 备注
+        self.parse_amounts()
 
     def is_assets(self):
         return False
@@ -53,47 +59,46 @@ class CMBTransaction(Transaction):
     def description(self):
         return self.payee
 
-    def metadata(self):
-        card = self.card_last_digit
-
-        if CMBCreditCard.map_cards:
-            card = _map_card(int(card))
+    def ledger_key(self):
+        # amount of the first posting
+        amount = None
+        if self.income_value is not None and self.expenses_value is not None:
+            amount = -(self.income_value + self.expenses_value)
+        return ('cmb credit', self.trade_date, self.settled_date,
+                self.payee, amount)
 
+    @classmethod
+    def build_templates(cls):
         metadata = (
             '  bill: "cmb credit"\n'
-            '  trade_date:"{0.trade_date}"\n'
-            '  card:"{1}"\n'
-        ).format(self, card)
-
+            '  trade_date:"{3}"\n'
+            '  card:"{4}"\n'
+        )
         if CMBCreditCard.show_linked:
-            link = (
-                '; link: "{0}"\n'
-            ).format(self.link)
-            metadata += link
-
-        return metadata
-
-    def postings(self):
-        if not self.income:
-            return (
-                '  {1} -{0.amount} CNY\n'
-                '  ! Expenses:Uncategorized +{0.amount} CNY'
-            ).format(self, self.beancount_account())
-        else:
-            return (  # Refunds
-                '  {1} +{0.amount} CNY\n'
-                '  ! Expenses:Uncategorized -{0.amount} CNY'
-            ).format(self, self.beancount_account())
+            metadata += '; link: "{5}"\n'
+
+        head = (
+            '{0} ' + Account.beancount_flags + ' "{1}" {2}\n' + metadata
+        )
+        return {
+            'expenses': head + (
+                '  {6} -{7} CNY\n'
+                '  ! Expenses:Uncategorized +{7} CNY'),
+            'refund': head + (
+                '  {6} +{7} CNY\n'
+                '  ! Expenses:Uncategorized -{7} CNY'),
+        }
 
     def beancount_repr(self):
-        metadata = self.metadata()
-        flags = Account.beancount_flags
-        postings = self.postings()
-        return (
-            '{0.settled_date} {3} "{0.payee}" {0.comment}\n'
-            '{1}'
-            '{2}'
-            ).format(self, metadata, postings, flags)
+        card = self.card_last_digit
+        if CMBCreditCard.map_cards:
+            card = _map_card(int(card))
+
+        templates = self.templates()
+        template = templates['refund' if self.income else 'expenses']
+        return template.format(
+            self.settled_date, self.payee, self.comment, self.trade_date,
+            card, self.link, self.beancount_account(), self.amount)
 
 
 def _map_card(last4):
@@ -115,23 +120,44 @@ def main():
         'csv',
         help=(
             'CSV file of China Merchants Bank credit cards\n'
-            'or directory that contains CSV files')
+            'or directory that contains CSV files, - to read from stdin')
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
+    stats.add_arguments(argparser)
     args = argparser.parse_args()
     if args._pass:
         Account.beancount_flags = "*"
 
     csv = args.csv
     cmb = CMBCreditCard()
-    if os.path.isfile(csv):
-        cmb.load_csv_file(csv)
-    elif os.path.isdir(csv):
-        cmb.load_csv_directory(csv)
-    else:
-        print('Path not exist: ' + csv)
-        return 1
-    cmb.print_beancount_bills()
+    import_stats = ImportStats()
+    with stats.profiled(args.profile):
+        if csv == '-' or os.path.isfile(csv):
+            # a single file needs no sorting, stream it
+            with import_stats.stage('stream', 'CMBCreditCard') as s:
+                if csv == '-':
+                    transactions = cmb.iter_csv(open_csv_stream(sys.stdin.buffer))
+                else:
+                    transactions = cmb.iter_csv_file(csv)
+                with open_output(args.output) as out:
+                    cmb.print_beancount_bills(
+                        stats.counted(transactions, s), out)
+        elif os.path.isdir(csv):
+            cmb.load_csv_directory(csv, stats=import_stats)
+            with import_stats.stage('output') as s:
+                with open_output(args.output) as out:
+                    cmb.print_beancount_bills(out=out)
+                s.rows = len(cmb.transactions)
+        else:
+            print('Path not exist: ' + csv)
+            return 1
+
+    if args.stats:
+        import_stats.report()
 
 
 if __name__ == '__main__':
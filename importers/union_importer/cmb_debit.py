@@ -4,12 +4,15 @@
 import sys
 import csv
 import argparse
-from datetime import datetime
-import glob
 import os
 
 from base import Account
 from base import Transaction
+from csvfile import open_csv_stream
+import stats
+from stats import ImportStats
+from writer import open_output
+from timeparse import parse_compact_datetime
 
 
 # 招商银行借记卡
@@ -22,14 +25,6 @@ class CMBDebitCard(Account):
         self.beancount_account = "Assets:CMB:DebitCard"
 
     # csv processing
-    def load_csv(self):
-        for f in glob.glob(os.path.join(self.path, "*.csv")):
-            csv_data = open(f)
-            self.parser_csv(csv_data)
-            csv_data.close()
-
-        self.transactions.sort(key=lambda t: t.sort_key())
-
     def parser_row(self, row):
         if row[0].strip().startswith('#'):
             return None
@@ -38,9 +33,10 @@ class CMBDebitCard(Account):
 
 class CMBDebitTransaction(Transaction):
     """docstring for CMBDebitTransaction"""
+    __slots__ = ('datetime', 'trade_time', 'balance', 'category')
+
     def __init__(self, row):
-        super(CMBDebitTransaction, self).__init__()
-        self.row = row
+        super(CMBDebitTransaction, self).__init__(row)
         if len(row) == 5:
             self.csv_5_fields_type(row)
         elif len(row) == 7:
@@ -48,6 +44,7 @@ class CMBDebitTransaction(Transaction):
         else:
             print("Unknow CMB debit csv file\nrow:" + str(row))
             sys.exit(1)
+        self.parse_amounts()
 
     def csv_7_fields_type(self, row):
         bd = row[0].strip()  # 交易日期
@@ -67,9 +64,8 @@ class CMBDebitTransaction(Transaction):
 
     def csv_5_fields_type(self, row):
         date = row[0].strip()  # 交易时间
-        self.datetime = datetime.strptime(date, '%Y%m%d  %H:%M:%S')
-        self.trade_date = self.datetime.date().strftime('%Y-%m-%d')
-        self.trade_time = self.datetime.time().strftime('%H:%M:%S')
+        self.datetime, self.trade_date, self.trade_time = \
+            parse_compact_datetime(date)
 
         amount = row[1].strip().replace(',', '')  # 收支
         if amount.startswith('-'):
@@ -86,29 +82,42 @@ class CMBDebitTransaction(Transaction):
     def description(self):
         return self.category
 
-    def beancount_postings(self):
-        if self.income:
-            return (
-                '  ! Income:Uncategorized -{0.income} CNY\n'
-                '  {1} +{0.income} CNY'
-            ).format(self, self.beancount_account())
-        else:
-            return (
-                '  {1} {0.expenses} CNY\n'
-                '  ! Expenses:Uncategorized +{0.amount} CNY'
-            ).format(self, self.beancount_account())
+    def trade_datetime(self):
+        # the 7 fields csv has no datetime
+        return getattr(self, 'datetime', None)
 
-    def beancount_repr(self):
-        date = self.beancount_transaction_date()
-        return (
-            '{3} {2} "" "{0.comment}"\n'
+    def ledger_key(self):
+        return ('cmb debit', self.trade_date, self.trade_time, self.balance)
+
+    @classmethod
+    def build_templates(cls):
+        head = (
+            '{0} ' + Account.beancount_flags + ' "" "{1}"\n'
             '  bill:"cmb debit"\n'
-            '  trade_date:"{0.trade_date}"\n'
-            '  time:"{0.trade_time}"\n'
-            '  type:"{0.category}"\n'
-            '  balance:"{0.balance}"\n'
-            '{1}'
-            ).format(self, self.beancount_postings(), Account.beancount_flags, date)
+            '  trade_date:"{2}"\n'
+            '  time:"{3}"\n'
+            '  type:"{4}"\n'
+            '  balance:"{5}"\n'
+        )
+        return {
+            'income': head + (
+                '  ! Income:Uncategorized -{7} CNY\n'
+                '  {6} +{7} CNY'),
+            'expenses': head + (
+                '  {6} {7} CNY\n'
+                '  ! Expenses:Uncategorized +{8} CNY'),
+        }
+
+    def beancount_repr(self):
+        templates = self.templates()
+        if self.income:
+            template, amount = templates['income'], self.income
+        else:
+            template, amount = templates['expenses'], self.expenses
+        return template.format(
+            self.beancount_transaction_date(), self.comment, self.trade_date,
+            self.trade_time, self.category, self.balance,
+            self.beancount_account(), amount, self.amount)
 
 
 def main():
@@ -117,23 +126,44 @@ def main():
         'csv',
         help=(
             'CSV file of China Merchants Bank debit cards\n'
-            'or directory that contains CSV files')
+            'or directory that contains CSV files, - to read from stdin')
     )
     argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
+    stats.add_arguments(argparser)
     args = argparser.parse_args()
     if args._pass:
         Account.beancount_flags = "*"
 
     csv = args.csv
     cmb = CMBDebitCard()
-    if os.path.isfile(csv):
-        cmb.load_csv_file(csv)
-    elif os.path.isdir(csv):
-        cmb.load_csv_directory(csv)
-    else:
-        print('Path not exist: ' + csv)
-        return 1
-    cmb.print_beancount_bills()
+    import_stats = ImportStats()
+    with stats.profiled(args.profile):
+        if csv == '-' or os.path.isfile(csv):
+            # a single file needs no sorting, stream it
+            with import_stats.stage('stream', 'CMBDebitCard') as s:
+                if csv == '-':
+                    transactions = cmb.iter_csv(open_csv_stream(sys.stdin.buffer))
+                else:
+                    transactions = cmb.iter_csv_file(csv)
+                with open_output(args.output) as out:
+                    cmb.print_beancount_bills(
+                        stats.counted(transactions, s), out)
+        elif os.path.isdir(csv):
+            cmb.load_csv_directory(csv, stats=import_stats)
+            with import_stats.stage('output') as s:
+                with open_output(args.output) as out:
+                    cmb.print_beancount_bills(out=out)
+                s.rows = len(cmb.transactions)
+        else:
+            print('Path not exist: ' + csv)
+            return 1
+
+    if args.stats:
+        import_stats.report()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+'''Columnar candidate search of Resolver, needs numpy
+
+ColumnStore keeps the transactions of every account as typed arrays:
+trade dates and amount keys are interned to integers shared by all
+accounts, one row per (transaction, key). ColumnarSimilarIndex finds the
+same candidates as base.SimilarIndex, but for all transactions of an
+account at once, by joining the rows of two accounts with sorting and
+binary search instead of one dict lookup per transaction and key.
+Transactions are still compared with looks_like, only the candidates
+come from the arrays.
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# date id and amount id in one int64
+_SHIFT = 1 << 32
+
+
+def available():
+    return numpy is not None
+
+
+def _join(left_codes, left_rows, right_codes, right_rows):
+    """(left rows, right rows) of every pair of equal codes
+    """
+    order = numpy.argsort(right_codes, kind='stable')
+    codes = right_codes[order]
+    start = numpy.searchsorted(codes, left_codes, 'left')
+    counts = numpy.searchsorted(codes, left_codes, 'right') - start
+    total = int(counts.sum())
+    if not total:
+        empty = numpy.zeros(0, numpy.int64)
+        return empty, empty
+
+    # offset of every pair inside the run of its left row
+    first = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    offsets = numpy.arange(total) - first
+    right = right_rows[order[numpy.repeat(start, counts) + offsets]]
+    return numpy.repeat(left_rows, counts), right
+
+
+class _KeyColumn(object):
+    """One row per distinct amount key of every transaction, transactions
+    have None key are wildcards of their trade date
+    """
+    def __init__(self, keys, days, amounts):
+        super(_KeyColumn, self).__init__()
+        rows = []
+        codes = []
+        wild = []
+        for pos, k in enumerate(keys):
+            k = set(k)
+            if None in k:
+                wild.append(pos)
+                continue
+            day = days[pos] * _SHIFT
+            for amount in k:
+                a = amounts.get(amount)
+                if a is None:
+                    a = amounts[amount] = len(amounts)
+                rows.append(pos)
+                codes.append(day + a)
+
+        self.rows = numpy.array(rows, numpy.int64)
+        self.codes = numpy.array(codes, numpy.int64)
+        self.wild = numpy.array(wild, numpy.int64)
+
+
+class TransactionColumns(object):
+    """Arrays of the transactions of one account
+    """
+    def __init__(self, transactions, dates, amounts):
+        super(TransactionColumns, self).__init__()
+        self.transactions = transactions
+        days = []
+        for t in transactions:
+            d = dates.get(t.trade_date)
+            if d is None:
+                d = dates[t.trade_date] = len(dates)
+            days.append(d)
+        self.days = numpy.array(days, numpy.int64)
+        self.rows = numpy.arange(len(transactions), dtype=numpy.int64)
+        self.similar = _KeyColumn(
+            [t.similar_keys() for t in transactions], days, amounts)
+        self.amount = _KeyColumn(
+            [t.amount_keys() for t in transactions], days, amounts)
+
+
+class ColumnStore(object):
+    def __init__(self):
+        super(ColumnStore, self).__init__()
+        self.dates = {}
+        self.amounts = {}
+        self.accounts = {}
+
+    def columns(self, account):
+        """Columns of account's transactions, made on first call
+        """
+        c = self.accounts.get(account)
+        if c is None or c.transactions is not account.transactions:
+            c = TransactionColumns(
+                account.transactions, self.dates, self.amounts)
+            self.accounts[account] = c
+        return c
+
+    def similar_index(self, account):
+        return ColumnarSimilarIndex(self, account)
+
+
+class ColumnarSimilarIndex(object):
+    def __init__(self, store, account):
+        super(ColumnarSimilarIndex, self).__init__()
+        self.store = store
+        self.columns = store.columns(account)
+        self.joined = set()
+        self.found = {}
+
+    def join(self, query):
+        """Find candidates of every transaction in query columns
+        """
+        index = self.columns
+        n = len(index.transactions)
+        if not n:
+            return
+
+        pairs = []
+        # index transactions which looks like query, and the reverse
+        for keys, column in ((query.amount, index.similar),
+                             (query.similar, index.amount)):
+            pairs.append(_join(
+                keys.codes, keys.rows, column.codes, column.rows))
+            # query has an unknown amount, all transactions of the date
+            pairs.append(_join(
+                query.days[keys.wild], keys.wild, index.days, index.rows))
+            # same for transactions of this index
+            pairs.append(_join(
+                query.days, query.rows, index.days[column.wild], column.wild))
+
+        left = numpy.concatenate([p[0] for p in pairs])
+        right = numpy.concatenate([p[1] for p in pairs])
+        # sorted by query, then original order of this index
+        codes = numpy.unique(left * n + right)
+        if not len(codes):
+            return
+        left, right = numpy.divmod(codes, n)
+        starts = numpy.flatnonzero(numpy.diff(left)) + 1
+        queries = query.transactions
+        transactions = index.transactions
+        for q, group in zip(
+                left[numpy.r_[0, starts]].tolist(),
+                numpy.split(right, starts)):
+            self.found[queries[q]] = [transactions[i] for i in group.tolist()]
+
+    def candidates(self, ot):
+        """Transactions which may looks like ot, in original order, all
+        transactions of ot's account are joined on first call
+        """
+        account = ot.account
+        if account not in self.joined:
+            self.joined.add(account)
+            self.join(self.store.columns(account))
+        return self.found.get(ot, [])
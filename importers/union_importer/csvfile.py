@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+'''Open csv exports of banks whatever their encoding
+
+Exports are UTF-8 or GBK, sometimes with a BOM. The encoding is detected
+from the first few KB, then the file is decoded incrementally while the
+csv reader reads it, so files never need to be re-encoded beforehand.
+Plain files are memory-mapped and read in place, reversed_lines reads
+them from the last line without reading the whole file.
+'''
+
+import codecs
+import gzip
+import io
+import mmap
+import os
+import sys
+
+
+SAMPLE_SIZE = 1 << 14
+BUFFER_SIZE = 1 << 20
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def detect_encoding(sample):
+    """Encoding of a file starts with sample bytes, codecs of BOMs skip
+    the BOM while decoding
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # the sample may end in the middle of a character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        # superset of GBK and GB2312
+        return 'gb18030'
+
+
+class _MappedRaw(io.RawIOBase):
+    """Raw stream reading a memory-mapped file
+    """
+    def __init__(self, path):
+        super(_MappedRaw, self).__init__()
+        self.name = path
+        self.map = None
+        self.pos = 0
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self):
+        return True
+
+    def sample(self, size):
+        if self.map is None:
+            return b''
+        return self.map[:size]
+
+    def readinto(self, b):
+        if self.map is None:
+            return 0
+        n = min(len(b), len(self.map) - self.pos)
+        with memoryview(self.map) as view:
+            b[:n] = view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        super(_MappedRaw, self).close()
+
+
+def open_csv_stream(binary, encoding=None):
+    """Text stream of a binary stream which supports peek, such as
+    sys.stdin.buffer
+    """
+    if encoding is None:
+        encoding = detect_encoding(binary.peek(SAMPLE_SIZE)[:SAMPLE_SIZE])
+    return io.TextIOWrapper(binary, encoding=encoding)
+
+
+def reversed_lines(path, encoding=None):
+    """Yield lines of a plain file from the last one, with their line
+    breaks. UTF-16 files are decoded whole, their bytes can not be split
+    at newline bytes
+    """
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if encoding is None:
+                encoding = detect_encoding(m[:SAMPLE_SIZE])
+            if encoding == 'utf-16':
+                yield from reversed(list(io.StringIO(m[:].decode(encoding))))
+                return
+
+            end = len(m)
+            while end > 0:
+                # the line ends at end, with its line break
+                start = m.rfind(b'\n', 0, end - 1) + 1
+                yield m[start:end].decode(encoding)
+                end = start
+
+
+def open_csv_argument(path, encoding=None):
+    """open_csv for a path given on the command line, - is stdin
+    """
+    if path == '-':
+        return open_csv_stream(sys.stdin.buffer, encoding)
+    return open_csv(path, encoding)
+
+
+def open_csv(path, encoding=None):
+    """Open a csv file, or a .gz compressed one, for csv.reader
+    """
+    if path.endswith(".gz"):
+        return open_csv_stream(gzip.open(path, "rb"), encoding)
+
+    raw = _MappedRaw(path)
+    if encoding is None:
+        encoding = detect_encoding(raw.sample(SAMPLE_SIZE))
+    return io.TextIOWrapper(
+        io.BufferedReader(raw, BUFFER_SIZE), encoding=encoding)
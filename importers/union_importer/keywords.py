@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+'''Find which of many keywords a text contains, in one pass
+
+All keywords are compiled into one regular expression which is tried at
+every position of the text, longest keyword first. A keyword found also
+implies the shorter keywords it contains, they are collected when the
+matcher is built, so overlapping keywords are all reported.
+'''
+
+import re
+
+
+class KeywordMatcher(object):
+    def __init__(self, keywords):
+        """keywords is a list of (keyword, value) pairs, search returns
+        values of the keywords found
+        """
+        super(KeywordMatcher, self).__init__()
+        values = {}
+        for keyword, value in keywords:
+            if keyword:
+                values.setdefault(keyword, []).append(value)
+
+        # values of a keyword and all keywords inside it
+        self.found = {}
+        for keyword in values:
+            found = []
+            for other, other_values in values.items():
+                if other in keyword:
+                    found.extend(other_values)
+            self.found[keyword] = found
+
+        self.pattern = None
+        if values:
+            ordered = sorted(values, key=len, reverse=True)
+            self.pattern = re.compile(
+                '(?=(' + '|'.join(re.escape(k) for k in ordered) + '))')
+
+    def search(self, text):
+        """Set of values whose keyword is in text
+        """
+        result = set()
+        if self.pattern is None or not text:
+            return result
+        for m in self.pattern.finditer(text):
+            result.update(self.found[m.group(1)])
+        return result
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''Index of transactions already imported into a beancount ledger
+
+The ledger is scanned line by line, every transaction written by these
+importers has a bill metadata, its key is made from the metadata which
+beancount_repr writes, see Transaction.ledger_key. Keys are counted, so
+repeated transactions with the same key are matched one by one.
+'''
+
+import re
+from collections import Counter
+
+from base import parse_amount
+
+
+_ENTRY = re.compile(r'^(\d{4}-\d{2}-\d{2})\s+\S+\s+(?:"([^"]*)")?')
+_METADATA = re.compile(r'^\s+([A-Za-z][\w-]*):\s*"(.*)"\s*$')
+_POSTING = re.compile(r'^\s+(?:[!*]\s+)?[A-Z][\w:-]*\s+([-+]?[\d,.]+)\s')
+
+
+def entry_key(date, payee, metadata, amount):
+    """Key of a ledger entry, same as Transaction.ledger_key
+    """
+    bill = metadata.get('bill')
+    if bill in ('alipay record', 'alipay acclog'):
+        return (bill, metadata.get('tradeNo'))
+    if bill == 'cmb debit':
+        return (bill, metadata.get('trade_date'),
+                metadata.get('time'), metadata.get('balance'))
+    if bill == 'cmb credit':
+        return (bill, metadata.get('trade_date'), date, payee, amount)
+    return None
+
+
+class LedgerIndex(object):
+    def __init__(self):
+        super(LedgerIndex, self).__init__()
+        self.keys = Counter()
+
+    @classmethod
+    def from_file(cls, path):
+        index = cls()
+        with open(path, encoding='utf-8') as ledger:
+            index.scan(ledger)
+        return index
+
+    def scan(self, lines):
+        date = payee = None
+        metadata = None
+        amount = None
+        for line in lines:
+            m = _ENTRY.match(line)
+            if m:
+                self._add(date, payee, metadata, amount)
+                date, payee = m.groups()
+                metadata = {}
+                amount = None
+                continue
+            if line.startswith(';'):
+                continue
+            if metadata is None or not line[:1].isspace():
+                self._add(date, payee, metadata, amount)
+                metadata = None
+                continue
+
+            m = _METADATA.match(line)
+            if m:
+                metadata[m.group(1)] = m.group(2)
+                continue
+            m = _POSTING.match(line)
+            if m and amount is None:
+                amount = parse_amount(m.group(1))
+
+        self._add(date, payee, metadata, amount)
+
+    def _add(self, date, payee, metadata, amount):
+        if not metadata:
+            return
+        key = entry_key(date, payee, metadata, amount)
+        if key:
+            self.keys[key] += 1
+
+    def take(self, t):
+        """Return True if t is in the ledger, each ledger entry is
+        taken once
+        """
+        key = t.ledger_key()
+        if not key or self.keys[key] <= 0:
+            return False
+        self.keys[key] -= 1
+        return True
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+'''Pair up transactions which look like more than one other transaction
+
+Repeated payments of the same amount on the same day, like subway fares,
+look like each other in both accounts. They are split into connected
+groups of candidate pairs, and every group is paired to minimize the
+total time between paired transactions:
+
+    sorted      every left looks like every right and all times are
+                known: pairing in time order is optimal, a small
+                dynamic program when the sides have different sizes
+    assignment  the Hungarian method on the cost matrix, for groups up
+                to ASSIGNMENT_LIMIT cells
+    greedy      pairs with the smallest cost first, for larger groups
+                and groups of more than two accounts
+    unpaired    no times, and rows of a side differ so their order
+                tells nothing
+
+Edges both transactions found are trusted more than edges only one of
+them found, a transaction may accept any row of the same amount, so in
+a group with edges found from both sides the others are not used.
+Without times, transactions are paired in their original order if they
+can be swapped: all transactions of a side are of the same account and
+description. Else the group is left unpaired, pairing by order would
+link unrelated rows.
+
+Groups are small and the Hungarian method is cubic, so it is limited to
+about 50 transactions on each side, larger groups cost n log n of their
+candidate pairs.
+'''
+
+
+ASSIGNMENT_LIMIT = 2500
+
+
+def components(edges):
+    """Connected groups of edges, edges are pairs of hashable nodes,
+    groups keep the order of edges
+    """
+    parent = {}
+
+    def find(x):
+        root = x
+        while parent[root] is not root:
+            root = parent[root]
+        while parent[x] is not root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for a, b in edges:
+        parent.setdefault(a, a)
+        parent.setdefault(b, b)
+        root_a, root_b = find(a), find(b)
+        if root_a is not root_b:
+            parent[root_b] = root_a
+
+    groups = {}
+    for a, b in edges:
+        groups.setdefault(find(a), []).append((a, b))
+    return list(groups.values())
+
+
+def _pair_sorted(left, right):
+    """Pair points on a line, every left can pair with every right,
+    return pairs of indexes minimizing the sum of distances
+    """
+    lo = sorted(range(len(left)), key=left.__getitem__)
+    ro = sorted(range(len(right)), key=right.__getitem__)
+    if len(lo) == len(ro):
+        return list(zip(lo, ro))
+
+    swapped = len(lo) > len(ro)
+    if swapped:
+        lo, ro, left, right = ro, lo, right, left
+
+    # best[i][j]: first i of the smaller side paired in first j
+    n, m = len(lo), len(ro)
+    inf = float('inf')
+    best = [[0.0] * (m + 1)] + [[inf] * (m + 1) for _ in range(n)]
+    for i in range(1, n + 1):
+        a = left[lo[i - 1]]
+        row, prev = best[i], best[i - 1]
+        for j in range(i, m + 1):
+            paired = prev[j - 1] + abs(a - right[ro[j - 1]])
+            row[j] = min(row[j - 1], paired)
+
+    pairs = []
+    i, j = n, m
+    while i:
+        if best[i][j] == best[i][j - 1] and j > i:
+            j -= 1
+        else:
+            pairs.append((lo[i - 1], ro[j - 1]))
+            i -= 1
+            j -= 1
+    pairs.reverse()
+    if swapped:
+        pairs = [(b, a) for a, b in pairs]
+    return pairs
+
+
+def _hungarian(cost):
+    """Minimum cost assignment of rows to columns, len(cost) rows are not
+    more than columns. Return the column of every row
+    """
+    n, m = len(cost), len(cost[0])
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    # p[j]: row assigned to column j, rows and columns from 1
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    column = [None] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            column[p[j] - 1] = j - 1
+    return column
+
+
+def _pair_assignment(n, m, costs):
+    swapped = n > m
+    if swapped:
+        n, m = m, n
+        costs = dict(((b, a), c) for (a, b), c in costs.items())
+    # cost of no edge, more than the sum of any pairs, so the most
+    # pairs are made first
+    no_edge = (max(costs.values()) + 1.0) * (n + 1)
+    matrix = [[no_edge] * m for _ in range(n)]
+    for (a, b), c in costs.items():
+        matrix[a][b] = c
+    pairs = [(a, b) for a, b in enumerate(_hungarian(matrix))
+             if (a, b) in costs]
+    if swapped:
+        pairs = [(b, a) for a, b in pairs]
+    return pairs
+
+
+def _pair_greedy(edges, cost):
+    pairs = []
+    used = set()
+    for a, b in sorted(edges, key=cost):
+        if a not in used and b not in used:
+            used.add(a)
+            used.add(b)
+            pairs.append((a, b))
+    return pairs
+
+
+def pair(left, right, edges, times, mutual=None, kinds=None):
+    """Pair nodes of one group. left and right are nodes in original
+    order, edges are (left, right) candidate pairs, times maps nodes to
+    seconds or None. mutual is the set of edges found from both sides,
+    kinds maps nodes to their account and description, nodes of the
+    same kind can be swapped. Return (pairs, method)
+    """
+    if mutual:
+        found = [e for e in edges if e in mutual]
+        if found and len(found) < len(edges):
+            edges = found
+            nodes = set(x for e in edges for x in e)
+            left = [x for x in left if x in nodes]
+            right = [x for x in right if x in nodes]
+
+    timed = all(times.get(x) is not None for x in left + right)
+    if not timed and kinds is not None:
+        if len(set(kinds[x] for x in left)) > 1 or \
+           len(set(kinds[x] for x in right)) > 1:
+            return [], 'unpaired'
+
+    def cost(edge):
+        if timed:
+            return abs(times[edge[0]] - times[edge[1]])
+        return 0.0
+
+    if not set(left).isdisjoint(right):
+        # a node on both sides, not a bipartite graph
+        return _pair_greedy(edges, cost), 'greedy'
+
+    li = dict((x, i) for i, x in enumerate(left))
+    ri = dict((x, i) for i, x in enumerate(right))
+    if len(edges) == len(left) * len(right):
+        if timed:
+            found = _pair_sorted([times[x] for x in left],
+                                 [times[x] for x in right])
+        else:
+            found = _pair_sorted(list(range(len(left))),
+                                 list(range(len(right))))
+        method = 'sorted'
+    elif len(left) * len(right) <= ASSIGNMENT_LIMIT:
+        costs = dict(((li[a], ri[b]), cost((a, b))) for a, b in edges)
+        found = _pair_assignment(len(left), len(right), costs)
+        method = 'assignment'
+    else:
+        return _pair_greedy(edges, cost), 'greedy'
+
+    return [(left[a], right[b]) for a, b in found], method
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+'''Importers of union_importer, by the folder of bills they read
+
+    alipay/      -> alipay.Alipay
+    cmb_credit/  -> cmb_credit.CMBCreditCard
+    cmb_debit/   -> cmb_debit.CMBDebitCard
+
+A module is imported only when its folder exists in the bills directory,
+so startup does not pay for importers which are not used. A new importer
+is added here, with the folder_name of its Account subclass.
+'''
+
+import importlib
+import os
+
+
+# folder, module, class, in the order accounts are loaded and resolved
+IMPORTERS = (
+    ("alipay", "alipay", "Alipay"),
+    ("cmb_credit", "cmb_credit", "CMBCreditCard"),
+    ("cmb_debit", "cmb_debit", "CMBDebitCard"),
+)
+
+
+def folder_names():
+    return [folder for folder, _, _ in IMPORTERS]
+
+
+def importer_class(folder_name):
+    """Import the Account subclass which reads folder_name
+    """
+    for folder, module, name in IMPORTERS:
+        if folder == folder_name:
+            cls = getattr(importlib.import_module(module), name)
+            if cls.folder_name != folder:
+                raise ValueError("{}.{} reads {}, not {}".format(
+                    module, name, cls.folder_name, folder))
+            return cls
+    raise KeyError(folder_name)
+
+
+def transaction_class(kind):
+    """Import the Transaction subclass named module.Class, only from the
+    modules of importers, kind may come from a file
+    """
+    from base import Transaction
+
+    module, _, name = kind.rpartition('.')
+    if module not in set(m for _, m, _ in IMPORTERS):
+        raise KeyError(kind)
+    cls = getattr(importlib.import_module(module), name, None)
+    if not (isinstance(cls, type) and issubclass(cls, Transaction)):
+        raise KeyError(kind)
+    return cls
+
+
+def available_importers(directory):
+    """(Account subclass, path) of every folder exists in directory
+    """
+    importers = []
+    for folder in folder_names():
+        path = os.path.join(directory, folder)
+        if os.path.exists(path):
+            importers.append((importer_class(folder), path))
+    return importers
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+'''Time, row counts and memory of every import stage
+
+    stats = ImportStats()
+    with stats.stage('parse', 'Alipay') as s:
+        alipay.load_csv_files(files)
+        s.rows = alipay.loaded_rows()
+    stats.report()
+
+Parts of a stage done in pieces, like parsing every row, are timed as
+sub-stages of the running stage, added up and reported after it:
+
+    with stats.timed('merge_acclog'):
+        alipay.merge_acclog()
+
+Peak memory is the peak resident size of this process when the stage
+ends, worker processes of --jobs are not counted, neither are their
+sub-stages.
+'''
+
+import cProfile
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _peak_rss():
+    """Peak resident set size in bytes, None if unknown
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+class StageStats(object):
+    __slots__ = ('name', 'account', 'parent', 'seconds', 'rows', 'matched',
+                 'unmatched', 'peak_memory')
+
+    def __init__(self, name, account=None, parent=None):
+        super(StageStats, self).__init__()
+        self.name = name
+        self.account = account
+        # name of the stage of a sub-stage
+        self.parent = parent
+        self.seconds = 0.0
+        self.rows = None
+        self.matched = None
+        self.unmatched = None
+        self.peak_memory = None
+
+    def as_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+
+class ImportStats(object):
+    def __init__(self):
+        super(ImportStats, self).__init__()
+        self.stages = []
+        # (stage, its sub-stages by name) of stages running now
+        self.running = []
+
+    @contextmanager
+    def stage(self, name, account=None):
+        """Time the block, counters can be set on the yielded StageStats
+        """
+        s = StageStats(name, account)
+        subs = {}
+        self.running.append((s, subs))
+        start = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s.seconds = time.perf_counter() - start
+            s.peak_memory = _peak_rss()
+            self.running.pop()
+            self.stages.append(s)
+            for sub in subs.values():
+                sub.peak_memory = s.peak_memory
+                self.stages.append(sub)
+
+    def sub_stage(self, name):
+        """StageStats of sub-stage name of the running stage, seconds and
+        rows are added up by the caller
+        """
+        parent, subs = self.running[-1]
+        s = subs.get(name)
+        if s is None:
+            s = subs[name] = StageStats(name, parent.account, parent.name)
+            s.rows = 0
+        return s
+
+    @contextmanager
+    def timed(self, name):
+        """Add the time of the block to sub-stage name
+        """
+        s = self.sub_stage(name)
+        start = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s.seconds += time.perf_counter() - start
+
+    def as_dicts(self):
+        return [s.as_dict() for s in self.stages]
+
+    def total_seconds(self):
+        # sub-stages are in the time of their stage
+        return sum(s.seconds for s in self.stages if s.parent is None)
+
+    def report(self, out=None):
+        if out is None:
+            out = sys.stderr
+
+        def field(value):
+            return '-' if value is None else str(value)
+
+        out.write('{:<25} {:<16} {:>9} {:>8} {:>8} {:>9} {:>9}\n'.format(
+            'stage', 'account', 'seconds', 'rows', 'matched', 'unmatched',
+            'peak MB'))
+        for s in self.stages:
+            peak = None
+            if s.peak_memory is not None:
+                peak = '{:.1f}'.format(s.peak_memory / 1048576.0)
+            name = s.name if s.parent is None else '  ' + s.name
+            out.write(
+                '{:<25} {:<16} {:>9.3f} {:>8} {:>8} {:>9} {:>9}\n'.format(
+                    name, field(s.account), s.seconds, field(s.rows),
+                    field(s.matched), field(s.unmatched), field(peak)))
+        out.write('{:<42} {:>9.3f}\n'.format('total', self.total_seconds()))
+
+
+def counted(iterable, stage):
+    """Yield from iterable, counting rows of stage on the way
+    """
+    stage.rows = 0
+    for x in iterable:
+        stage.rows += 1
+        yield x
+
+
+def add_arguments(argparser):
+    argparser.add_argument(
+        '--stats', dest='stats', action='store_true',
+        help='print time, rows and peak memory of every stage to stderr'
+    )
+    argparser.add_argument(
+        '--profile', dest='profile', metavar='FILE',
+        help='write cProfile stats to FILE, read it with python -m pstats'
+    )
+
+
+@contextmanager
+def profiled(path):
+    """Run the block under cProfile and dump stats to path, if given
+    """
+    if not path:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
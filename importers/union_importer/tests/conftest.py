@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts import each other by module name
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+sys.path.insert(0, os.path.join(HERE, '..'))
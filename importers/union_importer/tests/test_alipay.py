@@ -0,0 +1,73 @@
+from alipay import AliAcclog
+from alipay import TransactionCombiner
+
+
+def _acclog(no, time, income='', expenses='', source='支付宝'):
+    return AliAcclog([no, '2016-03-01 ' + time, '转账', '', income, expenses,
+                      '0', source])
+
+
+def _combine(rows):
+    tc = TransactionCombiner()
+    results = []
+    for t in rows:
+        results.extend(tc.push_trans(t))
+    results.extend(tc.final())
+    return results
+
+
+def _pairs(results):
+    return [(t.tradeNo, t.relate.tradeNo if t.relate else None)
+            for t in results]
+
+
+def test_pair_not_adjacent():
+    rows = [
+        _acclog('1', '10:00:00', expenses='-5.00'),
+        _acclog('2', '10:00:01', expenses='-7.00'),
+        _acclog('3', '10:00:02', income='5.00', source='招商银行'),
+    ]
+    assert _pairs(_combine(rows)) == [('1', '3'), ('2', None)]
+
+
+def test_income_before_expenses():
+    rows = [
+        _acclog('1', '10:00:00', income='5.00', source='招商银行'),
+        _acclog('2', '10:00:03', expenses='-5.00'),
+    ]
+    results = _combine(rows)
+    # the expenses row represents the transfer
+    assert _pairs(results) == [('2', '1')]
+    assert results[0].relate.manager is results[0]
+
+
+def test_same_amount_pairs_in_one_second():
+    rows = [
+        _acclog('1', '10:00:00', expenses='-3.00'),
+        _acclog('2', '10:00:00', expenses='-3.00'),
+        _acclog('3', '10:00:00', income='3.00', source='招商银行'),
+        _acclog('4', '10:00:00', income='3.00', source='招商银行'),
+        _acclog('5', '10:00:00', expenses='-3.00'),
+        _acclog('6', '10:00:00', income='3.00', source='招商银行'),
+    ]
+    results = _combine(rows)
+    # the nearest unpaired row in csv order is taken
+    assert _pairs(results) == [('1', '4'), ('2', '3'), ('5', '6')]
+
+
+def test_amounts_written_differently():
+    rows = [
+        _acclog('1', '10:00:00', expenses='-5.0'),
+        _acclog('2', '10:00:01', income='5.00', source='招商银行'),
+        _acclog('3', '10:00:02', income='1,000.00', source='招商银行'),
+        _acclog('4', '10:00:03', expenses='-1000.00'),
+    ]
+    assert _pairs(_combine(rows)) == [('1', '2'), ('4', '3')]
+
+
+def test_rows_too_far_apart():
+    rows = [
+        _acclog('1', '10:00:00', expenses='-5.00'),
+        _acclog('2', '10:00:06', income='5.00', source='招商银行'),
+    ]
+    assert _pairs(_combine(rows)) == [('1', None), ('2', None)]
@@ -0,0 +1,170 @@
+import itertools
+import random
+
+import matching
+from matching import _hungarian
+from matching import _pair_assignment
+from matching import _pair_greedy
+from matching import _pair_sorted
+from matching import components
+from matching import pair
+
+
+def _distance(left, right, pairs):
+    return sum(abs(left[a] - right[b]) for a, b in pairs)
+
+
+def _best_distance(left, right):
+    # every way to pair the smaller side
+    if len(left) > len(right):
+        left, right = right, left
+    return min(
+        sum(abs(a - right[b]) for a, b in zip(left, chosen))
+        for chosen in itertools.permutations(range(len(right)), len(left)))
+
+
+def test_components_split_and_keep_order():
+    edges = [('a', 1), ('b', 2), ('c', 1), ('b', 3), ('d', 4)]
+    assert components(edges) == [
+        [('a', 1), ('c', 1)],
+        [('b', 2), ('b', 3)],
+        [('d', 4)],
+    ]
+
+
+def test_components_joined_by_a_later_edge():
+    edges = [('a', 1), ('b', 2), ('a', 2)]
+    assert components(edges) == [edges]
+
+
+def test_pair_sorted_in_time_order():
+    assert _pair_sorted([30, 10, 20], [21, 29, 12]) == [(1, 2), (2, 0), (0, 1)]
+
+
+def test_pair_sorted_ties_keep_original_order():
+    assert _pair_sorted([5, 5, 5], [5, 5, 5]) == [(0, 0), (1, 1), (2, 2)]
+    # right 0 and 1 are as near, the first one is taken
+    assert _pair_sorted([10], [0, 20]) == [(0, 0)]
+    assert _pair_sorted([0, 20], [10]) == [(0, 0)]
+
+
+def test_pair_sorted_unequal_sizes():
+    assert _pair_sorted([0, 100], [99]) == [(1, 0)]
+    assert _pair_sorted([99], [0, 100]) == [(0, 1)]
+    assert _pair_sorted([0, 50, 100], [1, 49, 70, 101, 200]) == [
+        (0, 0), (1, 1), (2, 3)]
+
+
+def test_pair_sorted_is_optimal():
+    rnd = random.Random(1)
+    for _ in range(200):
+        left = [rnd.randrange(100) for _ in range(rnd.randint(1, 4))]
+        right = [rnd.randrange(100) for _ in range(rnd.randint(1, 6))]
+        pairs = _pair_sorted(left, right)
+        assert len(pairs) == min(len(left), len(right))
+        assert len(set(a for a, _ in pairs)) == len(pairs)
+        assert len(set(b for _, b in pairs)) == len(pairs)
+        assert _distance(left, right, pairs) == _best_distance(left, right)
+
+
+def test_hungarian_is_optimal():
+    rnd = random.Random(2)
+    for _ in range(200):
+        n = rnd.randint(1, 4)
+        m = rnd.randint(n, 6)
+        cost = [[rnd.randrange(20) for _ in range(m)] for _ in range(n)]
+        column = _hungarian(cost)
+        assert len(set(column)) == n
+        best = min(sum(cost[i][j] for i, j in enumerate(chosen))
+                   for chosen in itertools.permutations(range(m), n))
+        assert sum(cost[i][j] for i, j in enumerate(column)) == best
+
+
+def test_pair_assignment_prefers_more_pairs():
+    # pairing 0 with 0 is cheapest, but leaves 1 alone
+    costs = {(0, 0): 0.0, (0, 1): 100.0, (1, 0): 0.0}
+    assert sorted(_pair_assignment(2, 2, costs)) == [(0, 1), (1, 0)]
+
+
+def test_pair_assignment_unequal_sizes():
+    costs = {(0, 0): 5.0, (1, 0): 1.0, (2, 0): 3.0, (2, 1): 9.0}
+    assert sorted(_pair_assignment(3, 2, costs)) == [(1, 0), (2, 1)]
+    swapped = dict(((b, a), c) for (a, b), c in costs.items())
+    assert sorted(_pair_assignment(2, 3, swapped)) == [(0, 1), (1, 2)]
+
+
+def test_pair_greedy_smallest_cost_first():
+    times = {'a': 0, 'b': 10, 1: 9, 2: 30}
+    edges = [('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+
+    def cost(edge):
+        return abs(times[edge[0]] - times[edge[1]])
+
+    assert _pair_greedy(edges, cost) == [('b', 1), ('a', 2)]
+
+
+def test_pair_complete_group_is_sorted():
+    times = {'a': 100, 'b': 0, 1: 5, 2: 90}
+    edges = [('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+    assert pair(['a', 'b'], [1, 2], edges, times) == (
+        [('b', 1), ('a', 2)], 'sorted')
+
+
+def test_pair_without_times_keeps_order():
+    times = {'a': None, 'b': 0, 1: 5, 2: 90}
+    edges = [('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+    assert pair(['a', 'b'], [1, 2], edges, times) == (
+        [('a', 1), ('b', 2)], 'sorted')
+
+
+def test_pair_incomplete_group_is_assigned():
+    times = {'a': 0, 'b': 10, 'c': 20, 1: 1, 2: 11}
+    edges = [('a', 1), ('b', 1), ('b', 2), ('c', 2)]
+    pairs, method = pair(['a', 'b', 'c'], [1, 2], edges, times)
+    assert method == 'assignment'
+    assert sorted(pairs) == [('a', 1), ('b', 2)]
+
+
+def test_pair_large_group_is_greedy(monkeypatch):
+    monkeypatch.setattr(matching, 'ASSIGNMENT_LIMIT', 4)
+    times = {'a': 0, 'b': 10, 'c': 20, 1: 1, 2: 11}
+    edges = [('a', 1), ('b', 1), ('b', 2), ('c', 2)]
+    assert pair(['a', 'b', 'c'], [1, 2], edges, times) == (
+        [('a', 1), ('b', 2)], 'greedy')
+
+
+def test_pair_not_bipartite_is_greedy():
+    times = {'a': 0, 'b': 3, 'c': 5}
+    edges = [('a', 'b'), ('b', 'c')]
+    assert pair(['a', 'b'], ['b', 'c'], edges, times) == (
+        [('b', 'c')], 'greedy')
+
+
+def test_pair_prefers_mutual_edges():
+    times = {'a': None, 'b': None, 1: None, 2: None, 3: None}
+    edges = [('a', 1), ('a', 2), ('a', 3), ('b', 1), ('b', 2), ('b', 3)]
+    # 1 is found from one side only, like a card row of another payee
+    mutual = set(edges[1:3] + edges[4:])
+    kinds = {'a': 'alipay', 'b': 'alipay', 1: 'shop', 2: 'alipay',
+             3: 'alipay'}
+    assert pair(['a', 'b'], [1, 2, 3], edges, times, mutual, kinds) == (
+        [('a', 2), ('b', 3)], 'sorted')
+
+
+def test_pair_one_sided_edges_only():
+    times = {'a': 0, 1: 5, 2: 1}
+    edges = [('a', 1), ('a', 2)]
+    assert pair(['a'], [1, 2], edges, times, set()) == (
+        [('a', 2)], 'sorted')
+
+
+def test_pair_untimed_different_kinds_unpaired():
+    times = {'a': None, 'b': 10, 1: 1, 2: 11}
+    edges = [('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+    kinds = {'a': 'x', 'b': 'x', 1: 'y', 2: 'z'}
+    assert pair(['a', 'b'], [1, 2], edges, times, set(edges), kinds) == (
+        [], 'unpaired')
+    # with times every node is known apart
+    times['a'] = 0
+    assert pair(['a', 'b'], [1, 2], edges, times, set(edges), kinds) == (
+        [('a', 1), ('b', 2)], 'sorted')
@@ -0,0 +1,87 @@
+from alipay import AliAcclog
+from alipay import Alipay
+from cmb_credit import CMBCreditCard
+from cmb_credit import CMBTransaction
+from union_importer import Resolver
+
+DATE = '2016-01-10'
+
+
+def _alipay(times, amount):
+    """Payments charged to the credit card through Alipay, two acclog
+    rows each
+    """
+    account = Alipay()
+    for i, time in enumerate(times):
+        account.acclog_transactions.append(AliAcclog([
+            'P{}'.format(i), DATE + ' ' + time, '商品', '', '',
+            '-' + amount, '0.00', '支付宝']))
+        account.acclog_transactions.append(AliAcclog([
+            'C{}'.format(i), DATE + ' ' + time, '充值', '', amount, '',
+            amount, '招商银行']))
+    for t in account.acclog_transactions:
+        t.account = account
+    account.finish_loading()
+    return account
+
+
+def _credit(payees, amount):
+    account = CMBCreditCard()
+    for payee in payees:
+        t = CMBTransaction(
+            ['未确认', DATE, DATE, payee, '1111', amount, '', ''])
+        t.account = account
+        account.transactions.append(t)
+    account.finish_loading()
+    return account
+
+
+def _linked_payees(resolver):
+    payees = []
+    for t in resolver.matched:
+        for x in (t, t.link[0]):
+            if isinstance(x, CMBTransaction):
+                payees.append(x.payee)
+    return sorted(payees)
+
+
+def test_rows_found_from_one_side_are_not_paired():
+    alipay = _alipay(['14:36:04', '05:08:52'], '99.00')
+    credit = _credit(
+        ['AMAZON', '支付宝（ 95188 ）', '支付宝（ 95188 ）'], '99.00')
+    r = Resolver([alipay, credit])
+    results = r.resolve()
+
+    assert _linked_payees(r) == ['支付宝（ 95188 ）', '支付宝（ 95188 ）']
+    assert sum(1 for t in results if t.payee == 'AMAZON') == 1
+
+    [group] = r.ambiguous
+    assert group['method'] == 'sorted'
+    assert [group['transactions'][i]['description']
+            for i in group['unpaired']] == ['AMAZON']
+
+
+def test_untimed_rows_of_different_descriptions_are_not_paired():
+    alipay = _alipay(['14:36:04', '05:08:52'], '99.00')
+    credit = _credit(['支付宝（ 95188 ）', '支付宝 花呗'], '99.00')
+    r = Resolver([alipay, credit])
+    results = r.resolve()
+
+    assert r.matched == []
+    assert len(results) == 4
+
+    [group] = r.ambiguous
+    assert group['method'] == 'unpaired'
+    assert group['pairs'] == []
+    assert group['unpaired'] == [0, 1, 2, 3]
+
+
+def test_untimed_rows_of_one_description_are_paired():
+    alipay = _alipay(['14:36:04', '05:08:52'], '99.00')
+    credit = _credit(['支付宝（ 95188 ）', '支付宝（ 95188 ）'], '99.00')
+    r = Resolver([alipay, credit])
+    results = r.resolve()
+
+    assert len(r.matched) == 2
+    assert len(results) == 2
+    assert r.ambiguous[0]['method'] == 'sorted'
@@ -0,0 +1,105 @@
+'''BillsWatcher.update output should always be the output of a full
+union_importer.py run over the same directory
+'''
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from generate import generate
+from watch import BillsWatcher
+
+UNION_IMPORTER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'union_importer.py')
+
+
+@pytest.fixture(scope='module')
+def bills(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('generated'))
+    generate(directory, 900, days=90)
+    return directory
+
+
+def _touch(path):
+    # a new mtime even if copied within the resolution of the clock
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def _put(bills, directory, path, name=None):
+    rel = os.path.relpath(path, bills)
+    if name is not None:
+        rel = os.path.join(os.path.dirname(rel), name)
+    target = os.path.join(directory, rel)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.copy(path, target)
+    _touch(target)
+
+
+def _full_import(directory, output):
+    subprocess.check_call(
+        [sys.executable, UNION_IMPORTER, '-o', output, directory],
+        stdout=subprocess.DEVNULL)
+    with open(output, encoding='utf-8') as f:
+        return f.read()
+
+
+def _read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_add_modify_delete(bills, tmp_path, capsys):
+    directory = str(tmp_path / 'bills')
+    output = str(tmp_path / 'watch.beancount')
+    expected = str(tmp_path / 'full.beancount')
+    watcher = BillsWatcher(directory, output)
+
+    def check():
+        dates = watcher.update()
+        assert _read(output) == _full_import(directory, expected)
+        return dates
+
+    files = sorted(glob.glob(os.path.join(bills, '*', '*.csv')))
+    last = {}
+    for f in files:
+        last[os.path.dirname(f)] = f
+    assert len(last) == 3
+
+    # all but the last statement of every folder
+    for f in files:
+        if f != last[os.path.dirname(f)]:
+            _put(bills, directory, f)
+    assert check() > 0
+    assert watcher.update() is None
+
+    # a new statement of one account, then the others
+    for folder, f in sorted(last.items()):
+        if folder.endswith('cmb_debit'):
+            _put(bills, directory, f)
+    assert check() > 0
+    for folder, f in sorted(last.items()):
+        if not folder.endswith('cmb_debit'):
+            _put(bills, directory, f)
+    assert check() > 0
+
+    # a statement replaced by another one
+    credit = sorted(glob.glob(os.path.join(directory, 'cmb_credit', '*.csv')))
+    _put(bills, directory, last[os.path.join(bills, 'cmb_credit')],
+         os.path.basename(credit[0]))
+    assert check() > 0
+
+    # touched only, no dates linked again
+    _touch(credit[1])
+    assert check() == 0
+
+    # a statement removed, then a whole account
+    os.remove(credit[0])
+    assert check() > 0
+    shutil.rmtree(os.path.join(directory, 'cmb_debit'))
+    assert check() > 0
+    capsys.readouterr()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+'''Fast parsing of the fixed format timestamps in bills
+
+strptime is slow and the results are formatted again with strftime,
+bills use fixed width timestamps, so slice them instead. Dates repeat a
+lot in a bill, the date part is cached.
+'''
+
+from datetime import datetime
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(year, month, day):
+    y, m, d = int(year), int(month), int(day)
+    datetime(y, m, d)  # validate
+    return y, m, d, '{}-{}-{}'.format(year, month, day)
+
+
+def _parse(s, date, time):
+    y, m, d, trade_date = _parse_date(*date)
+    dt = datetime(y, m, d, int(time[0:2]), int(time[3:5]), int(time[6:8]))
+    return dt, trade_date, time
+
+
+def _parse_slow(s, fmt):
+    dt = datetime.strptime(s, fmt)
+    return dt, dt.strftime('%Y-%m-%d'), dt.strftime('%H:%M:%S')
+
+
+def _is_time(time):
+    return time[2] == ':' and time[5] == ':'
+
+
+def parse_iso_datetime(s):
+    """Parse '2016-02-01 08:30:00' (Alipay)
+    return (datetime, '2016-02-01', '08:30:00')
+    """
+    if len(s) == 19 and s[4] == '-' and s[7] == '-' and s[10] == ' ' \
+       and _is_time(s[11:]):
+        try:
+            return _parse(s, (s[0:4], s[5:7], s[8:10]), s[11:])
+        except ValueError:
+            pass
+    return _parse_slow(s, '%Y-%m-%d %H:%M:%S')
+
+
+def parse_compact_datetime(s):
+    """Parse '20160201  08:30:00' (CMB debit card)
+    return (datetime, '2016-02-01', '08:30:00')
+    """
+    if len(s) == 18 and s[8:10] == '  ' and _is_time(s[10:]):
+        try:
+            return _parse(s, (s[0:4], s[4:6], s[6:8]), s[10:])
+        except ValueError:
+            pass
+    return _parse_slow(s, '%Y%m%d  %H:%M:%S')
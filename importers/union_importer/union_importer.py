@@ -1,18 +1,18 @@
 #!/usr/bin/env python
 
-import sys
-import csv
 import argparse
 import datetime
-import base64
+import json
 import os
+import sys
 
 from base import Account
-from base import Transaction
-
-from alipay import Alipay
-from cmb_credit import CMBCreditCard
-from cmb_debit import CMBDebitCard
+from keywords import KeywordMatcher
+import registry
+import stats
+from stats import ImportStats
+from writer import BeancountWriter
+from writer import open_output
 
 
 class Resolver(object):
@@ -20,72 +20,407 @@ class Resolver(object):
     def __init__(self, accounts):
         super(Resolver, self).__init__()
         self.accounts = accounts
+        self.matched = []
+        self.remain = []
+        self.others = {}
+        for account in accounts:
+            self.others[account] = [x for x in accounts if x is not account]
+        self.matcher = KeywordMatcher(
+            [(k, a) for a in accounts for k in a.keywords()])
+        # descriptions repeat a lot, payees, sources and categories
+        self.possible = {}
+        self.groups = None
+        self.positions = None
+        # groups of transactions look like more than one, see pair_ambiguous
+        self.ambiguous = []
 
     def possible_accounts(self, t):
-        others = list(self.accounts)
-        others.remove(t.account)
-
-        desc = t.description()
-        a = [x for x in others if x.name in desc]
+        key = (t.account, t.description())
+        a = self.possible.get(key)
+        if a is None:
+            found = self.matcher.search(key[1])
+            a = [x for x in self.others[t.account] if x in found]
+            self.possible[key] = a
         return a
 
     def find_similar(self, t):
-        possibles = self.possible_accounts(t)
-        if not possibles:
-            return None
-
+        """Transactions of other accounts which looks like t
+        """
         similar = []
-        for a in possibles:
+        for a in self.possible_accounts(t):
             results = a.search_similar(t)
             if results:
                 similar.extend(results)
+        return similar
+
+    def resolve(self, window=None, jobs=1):
+        """Link similar transactions of all accounts, return all
+        transactions in output order. Given window, trade dates are
+        linked window days at a time, in jobs worker processes
+        """
+        if window:
+            matched, exclude = self.link_windows(window, jobs)
+            return self.results(matched, exclude)
+
+        store = None
+        if Account.columnar:
+            from columns import ColumnStore
+            store = ColumnStore()
 
-        # any similar?
-        if not similar:
-            return None
-
-        if len(similar) > 1:
-            print("more than one matched")
-            return None
-
-        return similar[0]
-
-    def resolve(self):
-
-        alltransactions = []
         for account in self.accounts:
-            alltransactions.extend(account.transactions)
-
+            account.build_similar_index(store)
+
+        matched, exclude = self.link_similar()
+        return self.results(matched, exclude)
+
+    def link_similar(self, dates=None):
+        """Link transactions to similar ones in other accounts, only
+        transactions of trade dates in dates if given. Similar
+        transactions always have the same trade date, so dates can be
+        linked separately. Return (matched, linked transactions)
+        """
+        queries = []
+        for account in self.accounts:
+            if dates is None:
+                queries.append(account.transactions)
+            else:
+                queries.append(
+                    [t for t in account.transactions if t.trade_date in dates])
+        return self.link_transactions(queries)
+
+    def link_transactions(self, queries):
+        """queries are lists of transactions to link, one for every
+        account
+        """
         matched = []
-        exclude = []
+        exclude = set()
+        # (t, similar) of transactions looks like more than one
+        ambiguous = []
 
-        for account in self.accounts:
-            for t in account.transactions:
+        for transactions in queries:
+            for t in transactions:
                 if t in exclude:
                     continue
 
                 similar = self.find_similar(t)
                 if not similar:
                     continue
+                if len(similar) > 1:
+                    ambiguous.append((t, similar))
+                    continue
 
+                similar = similar[0]
                 t.link_transaction(similar)
                 matched.append(t)
 
-                exclude.append(t)
-                exclude.append(similar)
+                exclude.add(t)
+                exclude.add(similar)
+
+        if ambiguous:
+            self.pair_ambiguous(ambiguous, matched, exclude)
+            matched.sort(key=self.position)
+        return matched, exclude
+
+    def pair_ambiguous(self, ambiguous, matched, exclude):
+        """Pair transactions which looks like more than one and are not
+        linked yet, nearest in time first, see matching.py. Every group
+        is recorded in self.ambiguous, groups which can not be paired
+        safely too
+        """
+        import matching
+
+        order = dict((a, i) for i, a in enumerate(self.accounts))
+        queried = set()
+        edges = []
+        seen = set()
+        for t, similar in ambiguous:
+            if t in exclude:
+                continue
+            for other in similar:
+                if other in exclude:
+                    continue
+                queried.add((t, other))
+                # transactions of the earlier account on the left
+                if order[t.account] < order[other.account]:
+                    edge = (t, other)
+                else:
+                    edge = (other, t)
+                if edge not in seen:
+                    seen.add(edge)
+                    edges.append(edge)
+
+        mutual = set(e for e in edges
+                     if e in queried and (e[1], e[0]) in queried)
+
+        for group in matching.components(edges):
+            left = sorted(set(a for a, _ in group), key=self.position)
+            right = sorted(set(b for _, b in group), key=self.position)
+            times = {}
+            kinds = {}
+            for x in left + right:
+                times[x] = _seconds(x)
+                kinds[x] = (x.account.folder_name, x.description())
+            pairs, method = matching.pair(
+                left, right, group, times, mutual, kinds)
+
+            for a, b in pairs:
+                # the transaction which found the other one is kept, the
+                # same as a transaction has only one similar
+                if (a, b) in queried:
+                    t, similar = a, b
+                else:
+                    t, similar = b, a
+                t.link_transaction(similar)
+                matched.append(t)
+                exclude.add(a)
+                exclude.add(b)
+
+            transactions = sorted(set(left + right), key=self.position)
+            self.ambiguous.append(
+                _ambiguity(transactions, pairs, method, times))
+
+    def by_date(self):
+        """Transactions of every account by trade date
+        """
+        if self.groups is None:
+            self.groups = []
+            for account in self.accounts:
+                dates = {}
+                for t in account.transactions:
+                    dates.setdefault(t.trade_date, []).append(t)
+                self.groups.append(dates)
+        return self.groups
+
+    def index_positions(self):
+        self.positions = {}
+        for i, account in enumerate(self.accounts):
+            for pos, t in enumerate(account.transactions):
+                self.positions[t] = (i, pos)
+
+    def position(self, t):
+        """(account, position in transactions of the account) of t
+        """
+        if self.positions is None:
+            self.index_positions()
+        return self.positions[t]
+
+    def link_window(self, dates):
+        """Link transactions of trade dates in dates, similar
+        transactions always have the same trade date
+        """
+        queries = []
+        for account, groups in zip(self.accounts, self.by_date()):
+            transactions = [t for d in dates for t in groups.get(d, ())]
+            account.build_similar_index(transactions=transactions)
+            queries.append(transactions)
+        return self.link_transactions(queries)
+
+    def link_windows(self, window, jobs=1):
+        """Link transactions window days at a time, only indexes of one
+        window are in memory. Return the same as link_similar
+        """
+        dates = set()
+        for groups in self.by_date():
+            dates.update(groups)
+        windows = _date_windows(dates, window)
+
+        matched = []
+        exclude = set()
+        executor = None
+        if jobs > 1 and len(windows) > 1:
+            executor = _fork_executor(self, jobs)
+
+        if executor is None:
+            for dates in windows:
+                m, e = self.link_window(dates)
+                matched.extend(m)
+                exclude.update(e)
+        else:
+            with executor:
+                chunksize = max(1, len(windows) // (jobs * 4))
+                for pairs, ambiguous in executor.map(
+                        _link_window, windows, chunksize=chunksize):
+                    self.ambiguous.extend(ambiguous)
+                    for i, pos, other, other_pos in pairs:
+                        t = self.accounts[i].transactions[pos]
+                        similar = self.accounts[other].transactions[other_pos]
+                        t.link_transaction(similar)
+                        matched.append(t)
+                        exclude.add(t)
+                        exclude.add(similar)
+
+        for account in self.accounts:
+            account.similar_index = None
+        # same order as link_similar matches them
+        matched.sort(key=self.position)
+        return matched, exclude
+
+    def results(self, matched, exclude):
+        """All transactions in output order, matched ones merged with
+        their links
+        """
+        alltransactions = []
+        for account in self.accounts:
+            alltransactions.extend(account.transactions)
 
         remain = [x for x in alltransactions if x not in exclude]
 
+        self.matched = matched
+        self.remain = remain
+
         final = matched + remain
         final.sort(key=lambda t: t.sort_key())
         return final
 
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _seconds(t):
+    dt = t.trade_datetime()
+    if dt is None:
+        return None
+    return (dt - _EPOCH).total_seconds()
+
+
+def _ambiguity(transactions, pairs, method, times):
+    """Report of a group of transactions looks like more than one
+    """
+    index = dict((t, i) for i, t in enumerate(transactions))
+    paired = set()
+    for a, b in pairs:
+        paired.add(a)
+        paired.add(b)
+
+    seconds = None
+    if all(times[t] is not None for t in transactions):
+        seconds = sum(abs(times[a] - times[b]) for a, b in pairs)
+
+    rows = []
+    for t in transactions:
+        dt = t.trade_datetime()
+        rows.append({
+            'account': t.account.folder_name,
+            'time': None if dt is None else dt.strftime('%H:%M:%S'),
+            'income': t.income,
+            'expenses': t.expenses,
+            'description': t.description(),
+        })
+    return {
+        'trade_date': transactions[0].trade_date,
+        'method': method,
+        'transactions': rows,
+        'pairs': [[index[a], index[b]] for a, b in pairs],
+        'unpaired': [i for i, t in enumerate(transactions)
+                     if t not in paired],
+        'seconds': seconds,
+    }
+
+
+def write_ambiguous(ambiguous, path):
+    """Write reports of Resolver.ambiguous as JSON lines
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        for group in ambiguous:
+            f.write(json.dumps(group, ensure_ascii=False, sort_keys=True))
+            f.write('\n')
+
+
+def _day_number(date):
+    try:
+        return datetime.date.fromisoformat(date).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def _date_windows(dates, window):
+    """Split trade dates into windows of window days, return a list of
+    sorted dates of every window
+    """
+    windows = {}
+    for date in dates:
+        day = _day_number(date)
+        # dates can not be parsed are in a window of their own
+        key = None if day is None else day // window
+        windows.setdefault(key, []).append(date)
+
+    return [sorted(windows[key], key=str)
+            for key in sorted(windows, key=lambda k: (k is None, k or 0))]
+
+
+# Resolver of forked workers of link_windows
+_forked = None
+
+
+def _fork_executor(resolver, jobs):
+    """Pool of workers forked from this process, they share the loaded
+    transactions instead of receiving them. None except on Linux, fork is
+    not available on Windows and not safe on macOS, where spawned workers
+    would have to receive all transactions
+    """
+    global _forked
+    import multiprocessing
+    if not sys.platform.startswith('linux'):
+        return None
+    from concurrent.futures import ProcessPoolExecutor
+
+    # computed once before forking
+    resolver.index_positions()
+    resolver.by_date()
+    _forked = resolver
+    return ProcessPoolExecutor(
+        jobs, mp_context=multiprocessing.get_context('fork'))
+
+
+def _link_window(dates):
+    """Process pool worker, link transactions of a window, return linked
+    pairs as positions of transactions, and Resolver.ambiguous of the
+    window
+    """
+    _forked.ambiguous = []
+    matched, _ = _forked.link_window(dates)
+    pairs = [_forked.position(t) + _forked.position(t.link[0])
+             for t in matched]
+    return pairs, _forked.ambiguous
+
+
 def _create_bills_subfolder(directory):
-    for a in Account.__subclasses__():
-        if a.folder_name:
-            path = os.path.join(directory, a.folder_name)
-            os.makedirs(path)
+    for folder in registry.folder_names():
+        os.makedirs(os.path.join(directory, folder))
+
+
+def load_accounts(directory, executor=None, cache=None, stats=None):
+    """Load every account which has a folder in the bills directory
+    """
+    accounts = []
+    for a, path in registry.available_importers(directory):
+        account = a()
+        account.load_csv_directory(path, executor, cache, stats)
+        accounts.append(account)
+    return accounts
+
+
+def apply_output_args(args):
+    """Set output control of Account
+    """
+    if args._pass:
+        Account.beancount_flags = "*"
+
+    if args.more_metadata:
+        Account.show_linked = True
+        Account.show_merged = True
+        Account.show_record = True
+        Account.keep_rows = True
+    if args.more_postings:
+        Account.show_postings_mid = True
+
+
+def _apply_args(args):
+    """Set options of Account, also used to initialize workers
+    """
+    apply_output_args(args)
+    if args.columnar:
+        Account.columnar = True
 
 
 def main():
@@ -107,17 +442,90 @@ def main():
         '--more_postings', dest='more_postings', action='store_true',
         help='show postins change detail'
     )
+    argparser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='parse csv files in N worker processes'
+    )
+    argparser.add_argument(
+        '--cache', dest='cache', action='store_true',
+        help='cache parsed csv files in the bills directory'
+    )
+    argparser.add_argument(
+        '--ledger', dest='ledger',
+        help='only print transactions not imported into this beancount file'
+    )
+    argparser.add_argument(
+        '--warehouse', dest='warehouse', metavar='FILE',
+        help='also store the transactions in a SQLite database, '
+             'see warehouse.py'
+    )
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
+    argparser.add_argument(
+        '--columnar', dest='columnar', action='store_true',
+        help='search related transactions with numpy arrays'
+    )
+    argparser.add_argument(
+        '--window', dest='window', type=int, metavar='DAYS',
+        help='link transactions DAYS days at a time'
+    )
+    argparser.add_argument(
+        '--window_jobs', dest='window_jobs', type=int, metavar='N',
+        help='link --window windows in N worker processes, only on Linux, '
+             'default -j'
+    )
+    argparser.add_argument(
+        '--ambiguous', dest='ambiguous', metavar='FILE',
+        help='write transactions looks like more than one, and how they '
+             'are paired, to FILE as JSON lines'
+    )
+    argparser.add_argument(
+        '--watch', dest='watch', action='store_true',
+        help='keep running, update the -o file when csv files change'
+    )
+    argparser.add_argument(
+        '--interval', dest='interval', type=float, default=2.0,
+        help='seconds between checks of --watch, default 2'
+    )
+    stats.add_arguments(argparser)
 
     args = argparser.parse_args()
-    if args._pass:
-        Account.beancount_flags = "*"
-
-    if args.more_metadata:
-        Account.show_linked = True
-        Account.show_merged = True
-        Account.show_record = True
-    if args.more_postings:
-        Account.show_postings_mid = True
+    if args.columnar:
+        import columns
+        if not columns.available():
+            print("--columnar needs numpy")
+            return 1
+    if args.window is not None and args.window < 1:
+        print("--window needs at least 1 day")
+        return 1
+    if args.window_jobs is not None and args.window_jobs < 1:
+        print("--window_jobs needs at least 1 worker")
+        return 1
+    if args.window and args.columnar:
+        # the columns of all transactions are what --window avoids
+        print("--columnar can not be used with --window")
+        return 1
+    if args.watch and not args.output:
+        print("--watch needs -o")
+        return 1
+    if args.watch:
+        # options of a single import, BillsWatcher does not use them
+        ignored = [name for name, value in (
+            ('--ambiguous', args.ambiguous),
+            ('--warehouse', args.warehouse),
+            ('--window', args.window),
+            ('--window_jobs', args.window_jobs),
+            ('--columnar', args.columnar),
+            ('--stats', args.stats),
+            ('--profile', args.profile),
+        ) if value]
+        if ignored:
+            print("{} can not be used with --watch".format(
+                ', '.join(ignored)))
+            return 1
+    _apply_args(args)
 
     directory = args.directory
 
@@ -135,20 +543,101 @@ def main():
             directory, ":path already exists."
         )
 
-    accounts = []
-    for a in Account.__subclasses__():
-        if a.folder_name:
-            path = os.path.join(directory, a.folder_name)
-            if os.path.exists(path):
-                account = a()
-                account.load_csv_directory(path)
-                accounts.append(account)
-
-    r = Resolver(accounts)
-    results = r.resolve()
-    for t in results:
-        print(t.beancount_repr())
-        print("\n")
+    if args.watch:
+        return _watch_directory(args, directory)
+
+    import_stats = ImportStats()
+    with stats.profiled(args.profile):
+        _import_directory(args, directory, import_stats)
+
+    if args.stats:
+        import_stats.report()
+
+
+# imported in functions, most runs need none of them
+def _create_executor(args):
+    if args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(
+            args.jobs, initializer=_apply_args, initargs=(args,))
+    return None
+
+
+def _open_cache(args, directory):
+    if args.cache:
+        from cache import ParsedCache
+        return ParsedCache.for_directory(directory)
+    return None
+
+
+def _watch_directory(args, directory):
+    from watch import BillsWatcher
+
+    executor = _create_executor(args)
+    cache = _open_cache(args, directory)
+    watcher = BillsWatcher(
+        directory, args.output, args.interval, cache, executor, args.ledger)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if executor:
+            executor.shutdown()
+        if cache:
+            cache.close()
+    return 0
+
+
+def _import_directory(args, directory, import_stats):
+    executor = _create_executor(args)
+    cache = _open_cache(args, directory)
+
+    accounts = load_accounts(directory, executor, cache, import_stats)
+
+    if executor:
+        executor.shutdown()
+    if cache:
+        cache.close()
+
+    with import_stats.stage('resolve') as s:
+        r = Resolver(accounts)
+        window_jobs = args.window_jobs
+        if window_jobs is None:
+            window_jobs = args.jobs
+        results = r.resolve(args.window, window_jobs)
+        s.rows = len(results)
+        s.matched = len(r.matched)
+        s.unmatched = len(r.remain)
+
+    if r.ambiguous:
+        unpaired = sum(len(g['unpaired']) for g in r.ambiguous)
+        print("{} groups looks like more than one are paired by time, "
+              "{} transactions left unlinked".format(
+                  len(r.ambiguous), unpaired), file=sys.stderr)
+    if args.ambiguous:
+        write_ambiguous(r.ambiguous, args.ambiguous)
+
+    if args.warehouse:
+        from warehouse import Warehouse
+        with import_stats.stage('warehouse') as s:
+            warehouse = Warehouse(args.warehouse)
+            s.rows = warehouse.store(results)
+            warehouse.close()
+
+    if args.ledger:
+        from ledger import LedgerIndex
+        with import_stats.stage('ledger') as s:
+            imported = LedgerIndex.from_file(args.ledger)
+            s.rows = len(results)
+            results = [t for t in results if not imported.take(t)]
+            s.matched = s.rows - len(results)
+            s.unmatched = len(results)
+
+    with import_stats.stage('output') as s:
+        with open_output(args.output) as out:
+            BeancountWriter(out).write_all(results)
+        s.rows = len(results)
 
 
 if __name__ == '__main__':
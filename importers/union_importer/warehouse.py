@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+'''SQLite store of imported bills, to query them and render them again
+
+    ./union_importer.py --warehouse bills.sqlite 2016-03
+    ./warehouse.py --more_metadata bills.sqlite
+
+union_importer.py --warehouse stores the resolved transactions, and the
+transactions they are merged from, replacing the previous import. Every
+transaction is a row of `transactions`, links between transactions are
+rows of `relations`: kind is link, relate, record, acclog or manager,
+seq is the order of links. warehouse.py renders the stored transactions
+with any output options, without parsing csv files again.
+
+CMB credit card rows linked to Alipay in March:
+
+    SELECT t.trade_date, t.payee, t.description, t.expenses
+    FROM transactions t
+    JOIN relations r ON r.source = t.id AND r.kind = 'link'
+    JOIN transactions o ON o.id = r.target
+    WHERE t.account = 'cmb_credit' AND o.account = 'alipay'
+      AND t.trade_date BETWEEN '2016-03-01' AND '2016-03-31';
+
+kind of transactions is the type, such as cmb_credit.CMBTransaction,
+amount is the absolute amount in cents, position is the order in the
+output and NULL for transactions merged into another one. fields is a
+JSON object of the attributes of the transaction by name, Decimal and
+datetime values are objects like {"$decimal": "1.00"}. The version of
+this layout is the version row of `meta`, a database of another version
+is not loaded, only replaced by the next import.
+'''
+
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+from operator import attrgetter
+
+import registry
+import stats
+from base import REFERENCES
+from base import value_slots
+from stats import ImportStats
+from union_importer import apply_output_args
+from writer import BeancountWriter
+from writer import open_output
+
+
+# version of the tables and fields, bump it when they change
+VERSION = 2
+
+_TABLES = ('meta', 'transactions', 'relations')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS transactions ('
+    ' id INTEGER PRIMARY KEY, position INTEGER, kind TEXT, account TEXT,'
+    ' trade_date TEXT, trade_no TEXT, payee TEXT, description TEXT,'
+    ' income TEXT, expenses TEXT, amount INTEGER, fields TEXT)',
+    'CREATE TABLE IF NOT EXISTS relations ('
+    ' source INTEGER, kind TEXT, target INTEGER, seq INTEGER)',
+)
+
+_INDEXES = (
+    ('transactions_date', 'transactions', 'trade_date'),
+    ('transactions_amount', 'transactions', 'amount'),
+    ('transactions_trade_no', 'transactions', 'trade_no'),
+    ('relations_source', 'relations', 'source'),
+    ('relations_target', 'relations', 'target'),
+)
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError('can not store {!r}'.format(value))
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '$decimal' in obj:
+            return Decimal(obj['$decimal'])
+        if '$datetime' in obj:
+            return datetime.fromisoformat(obj['$datetime'])
+    return obj
+
+
+def _cents(t):
+    amount = t.amount_keys()[0]
+    if amount is None:
+        return None
+    return int(amount.scaleb(2).to_integral_value())
+
+
+def _related(t):
+    """(kind, transaction) of every transaction t refers to
+    """
+    for name in REFERENCES:
+        other = getattr(t, name, None)
+        if other is not None:
+            yield name, other
+    for other in t.link:
+        yield 'link', other
+
+
+class Warehouse(object):
+    def __init__(self, path):
+        super(Warehouse, self).__init__()
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.version = self._stored_version()
+        if self.version is None:
+            self._create()
+
+    def _stored_version(self):
+        """Version of the database, None if empty, 1 if written before
+        the meta table
+        """
+        tables = set(name for (name,) in self.db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        if 'meta' not in tables:
+            return 1 if 'transactions' in tables else None
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else None
+
+    def _create(self):
+        with self.db:
+            for table in _TABLES:
+                self.db.execute('DROP TABLE IF EXISTS ' + table)
+            for statement in _SCHEMA:
+                self.db.execute(statement)
+            self._create_indexes()
+            self.db.execute(
+                "INSERT INTO meta VALUES ('version', ?)", (str(VERSION),))
+        self.version = VERSION
+
+    def _create_indexes(self):
+        for name, table, column in _INDEXES:
+            self.db.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                name, table, column))
+
+    def store(self, transactions):
+        """Replace the stored transactions, transactions they refer to
+        are stored too
+        """
+        ids = {}
+        ordered = []
+
+        def add(t):
+            if id(t) not in ids:
+                ids[id(t)] = len(ordered) + 1
+                ordered.append(t)
+
+        for t in transactions:
+            add(t)
+        # ordered grows while walking
+        for t in ordered:
+            for _, other in _related(t):
+                add(other)
+
+        positions = dict((id(t), i) for i, t in enumerate(transactions))
+
+        def transaction_rows():
+            dumps = json.JSONEncoder(
+                ensure_ascii=False, separators=(',', ':'),
+                default=_encode).encode
+            getters = {}
+            for t in ordered:
+                cls = type(t)
+                names = value_slots(cls)
+                get = getters.get(cls)
+                if get is None:
+                    get = getters[cls] = attrgetter(*names)
+                try:
+                    fields = dict(zip(names, get(t)))
+                except AttributeError:
+                    # attributes never set are left out
+                    fields = dict((name, getattr(t, name)) for name in names
+                                  if hasattr(t, name))
+                account = t.account.folder_name if t.account else None
+                yield (
+                    ids[id(t)], positions.get(id(t)),
+                    cls.__module__ + '.' + cls.__name__, account,
+                    t.trade_date, getattr(t, 'tradeNo', None), t.payee,
+                    t.description(), t.income, t.expenses, _cents(t),
+                    dumps(fields))
+
+        def relation_rows():
+            for t in ordered:
+                for seq, (kind, other) in enumerate(_related(t)):
+                    yield ids[id(t)], kind, ids[id(other)], seq
+
+        if self.version != VERSION:
+            # replaced anyway
+            self._create()
+
+        with self.db:
+            # faster to build the indexes once after the rows
+            for name, _, _ in _INDEXES:
+                self.db.execute('DROP INDEX IF EXISTS ' + name)
+            self.db.execute('DELETE FROM relations')
+            self.db.execute('DELETE FROM transactions')
+            self.db.executemany(
+                'INSERT INTO transactions VALUES'
+                ' (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', transaction_rows())
+            self.db.executemany(
+                'INSERT INTO relations VALUES (?, ?, ?, ?)', relation_rows())
+            self._create_indexes()
+        return len(ordered)
+
+    def load(self):
+        """Stored transactions in output order, with their references.
+        Raise ValueError if the database is of another version
+        """
+        if self.version != VERSION:
+            raise ValueError('{} is version {}, not {}'.format(
+                self.path, self.version, VERSION))
+
+        accounts = {}
+        classes = {}
+        objects = {}
+        loads = json.JSONDecoder(object_hook=_decode).decode
+        for row_id, kind, folder, fields in self.db.execute(
+                'SELECT id, kind, account, fields FROM transactions'):
+            c = classes.get(kind)
+            if c is None:
+                cls = registry.transaction_class(kind)
+                c = classes[kind] = (cls, set(value_slots(cls)), [
+                    r for r in REFERENCES if hasattr(cls, r)])
+            cls, names, references = c
+
+            t = cls.__new__(cls)
+            for name, value in loads(fields).items():
+                # fields the class does not have any more are dropped
+                if name in names:
+                    setattr(t, name, value)
+            for name in references:
+                setattr(t, name, None)
+            t.link = []
+
+            account = None
+            if folder:
+                account = accounts.get(folder)
+                if account is None:
+                    account = registry.importer_class(folder)()
+                    accounts[folder] = account
+            t.account = account
+            objects[row_id] = t
+
+        for source, kind, target in self.db.execute(
+                'SELECT source, kind, target FROM relations'
+                ' ORDER BY source, seq'):
+            t = objects[source]
+            if kind == 'link':
+                t.link.append(objects[target])
+            else:
+                setattr(t, kind, objects[target])
+
+        return [objects[row_id] for (row_id,) in self.db.execute(
+            'SELECT id FROM transactions WHERE position IS NOT NULL'
+            ' ORDER BY position')]
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        'path',
+        help='database written by union_importer.py --warehouse'
+    )
+    argparser.add_argument('-p', '--pass', dest='_pass', action='store_true')
+    argparser.add_argument(
+        '--more_metadata', dest='more_metadata', action='store_true',
+        help='show verbose metadata'
+    )
+    argparser.add_argument(
+        '--more_postings', dest='more_postings', action='store_true',
+        help='show postins change detail'
+    )
+    argparser.add_argument(
+        '-o', '--output', dest='output',
+        help='write to this file, replaced only after a complete run'
+    )
+    stats.add_arguments(argparser)
+
+    args = argparser.parse_args()
+    apply_output_args(args)
+
+    if not os.path.exists(args.path):
+        print("file not exists: " + args.path)
+        return 1
+
+    import_stats = ImportStats()
+    with stats.profiled(args.profile):
+        with import_stats.stage('load') as s:
+            warehouse = Warehouse(args.path)
+            if warehouse.version != VERSION:
+                print("{} is written by another version, import the bills"
+                      " again with union_importer.py --warehouse".format(
+                          args.path))
+                return 1
+            transactions = warehouse.load()
+            warehouse.close()
+            s.rows = len(transactions)
+
+        with import_stats.stage('output') as s:
+            with open_output(args.output) as out:
+                BeancountWriter(out).write_all(transactions)
+            s.rows = len(transactions)
+
+    if args.stats:
+        import_stats.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+'''Import a bills directory again whenever its csv files change
+
+    ./union_importer.py --watch -o 2016-03.beancount 2016-03
+
+Folders of the bills directory are polled every --interval seconds. Only
+accounts with new, changed or removed csv files are loaded again, and
+unchanged csv files come from a ParsedCache instead of being parsed.
+Similar transactions always have the same trade date, so only the trade
+dates whose transactions changed are linked again. Links of other dates
+are replayed from the previous update, and their rendered text is
+reused. The output file is replaced after every update, the same as a
+full run of union_importer.py would write it.
+'''
+
+import os
+import sys
+import time
+from operator import attrgetter
+
+import registry
+from base import REFERENCES
+from base import value_slots
+from cache import ParsedCache
+from union_importer import Resolver
+from writer import BeancountWriter
+from writer import open_output
+
+
+POLL_INTERVAL = 2.0
+
+# attribute getters and reference names, by transaction type
+_getters = {}
+_references = {}
+
+
+def _attributes(t):
+    cls = type(t)
+    get = _getters.get(cls)
+    if get is None:
+        get = _getters[cls] = attrgetter(*value_slots(cls))
+    try:
+        return get(t)
+    except AttributeError:
+        return tuple(getattr(t, name, None) for name in value_slots(cls))
+
+
+def _signature(t, depends):
+    """Everything of t which linking and rendering read, except links.
+    Trade dates of transactions t refers to are added to depends
+    """
+    cls = type(t)
+    names = _references.get(cls)
+    if names is None:
+        names = _references[cls] = [n for n in REFERENCES if hasattr(cls, n)]
+
+    refers = []
+    for name in names:
+        other = getattr(t, name)
+        if other is not None:
+            refers.append((name, _attributes(other)))
+            depends.add(other.trade_date)
+    return cls, _attributes(t), refers
+
+
+def _group_by_date(account):
+    dates = {}
+    for t in account.transactions:
+        dates.setdefault(t.trade_date, []).append(t)
+    return dates
+
+
+class BillsWatcher(object):
+    def __init__(self, directory, output, interval=POLL_INTERVAL,
+                 cache=None, executor=None, ledger=None):
+        super(BillsWatcher, self).__init__()
+        self.directory = directory
+        self.output = output
+        self.interval = interval
+        self.executor = executor
+        self.ledger = ledger
+        if cache is None:
+            cache = ParsedCache(':memory:')
+        self.cache = cache
+
+        # by folder name
+        self.accounts = {}
+        self.snapshots = {}
+        self.groups = {}
+        self.signatures = {}
+        # trade date -> other trade dates its transactions refer to
+        self.depends = {}
+        # trade date -> [(folder, position, similar folder, position)],
+        # positions are in the transactions of the date
+        self.links = {}
+        # (folder, trade date, position) -> beancount text
+        self.rendered = {}
+        self.written = False
+
+    def _snapshot(self, cls, path):
+        snapshot = {}
+        for f in cls().csv_files(path):
+            try:
+                st = os.stat(f)
+            except OSError:  # removed while listing
+                continue
+            snapshot[f] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def load_changed(self):
+        """Load accounts whose csv files changed, return their folders
+        """
+        changed = set()
+        present = set()
+        for cls, path in registry.available_importers(self.directory):
+            folder = cls.folder_name
+            present.add(folder)
+            snapshot = self._snapshot(cls, path)
+            if self.snapshots.get(folder) == snapshot:
+                continue
+
+            account = cls()
+            account.load_csv_directory(path, self.executor, self.cache)
+            self.accounts[folder] = account
+            self.snapshots[folder] = snapshot
+            changed.add(folder)
+
+        for folder in list(self.accounts):
+            if folder not in present:
+                del self.accounts[folder]
+                del self.snapshots[folder]
+                changed.add(folder)
+
+        self.cache.commit()
+        return changed
+
+    def changed_dates(self, folders):
+        """Trade dates whose transactions changed in accounts of folders,
+        and dates whose transactions refer to them
+        """
+        dates = set()
+        for folder in folders:
+            old = self.signatures.pop(folder, {})
+            self.groups.pop(folder, None)
+            self.depends.pop(folder, None)
+            new = {}
+            account = self.accounts.get(folder)
+            if account is not None:
+                groups = self.groups[folder] = _group_by_date(account)
+                depends = self.depends[folder] = {}
+                for date, transactions in groups.items():
+                    refers = set()
+                    new[date] = [_signature(t, refers) for t in transactions]
+                    refers.discard(date)
+                    if refers:
+                        depends[date] = refers
+                self.signatures[folder] = new
+
+            for date in set(old) | set(new):
+                if old.get(date) != new.get(date):
+                    dates.add(date)
+
+        # merged transactions can be a few seconds apart, over midnight
+        for depends in self.depends.values():
+            for date, refers in depends.items():
+                if not refers.isdisjoint(dates):
+                    dates.add(date)
+        return dates
+
+    def link(self, accounts, dates):
+        """Link transactions of dates again and replay links of other
+        dates, return Resolver.resolve results
+        """
+        for account in accounts:
+            for t in account.transactions:
+                t.link = []
+
+        resolver = Resolver(accounts)
+        matched = []
+        exclude = set()
+        links = {}
+        for date, pairs in self.links.items():
+            if date in dates:
+                continue
+            for folder, pos, other, other_pos in pairs:
+                t = self.groups[folder][date][pos]
+                similar = self.groups[other][date][other_pos]
+                t.link_transaction(similar)
+                matched.append(t)
+                exclude.add(t)
+                exclude.add(similar)
+            links[date] = pairs
+
+        for account in accounts:
+            account.build_similar_index(transactions=[
+                t for t in account.transactions if t.trade_date in dates])
+        linked, linked_exclude = resolver.link_similar(dates)
+        matched.extend(linked)
+        exclude.update(linked_exclude)
+
+        where = {}
+        for folder, groups in self.groups.items():
+            for date in dates:
+                for pos, t in enumerate(groups.get(date, ())):
+                    where[t] = (folder, pos)
+        for t in linked:
+            similar = t.link[0]
+            links.setdefault(t.trade_date, []).append(
+                where[t] + where[similar])
+        self.links = links
+
+        # same order as Resolver.resolve matched them
+        matched.sort(key=resolver.position)
+        return resolver.results(matched, exclude)
+
+    def render(self, results, dates):
+        """Beancount text of results, reused for unchanged dates
+        """
+        keys = {}
+        for folder, groups in self.groups.items():
+            for date, transactions in groups.items():
+                for pos, t in enumerate(transactions):
+                    keys[t] = (folder, date, pos)
+
+        rendered = {}
+        texts = []
+        for t in results:
+            key = keys[t]
+            text = None
+            if t.trade_date not in dates:
+                text = self.rendered.get(key)
+            if text is None:
+                text = t.beancount_repr()
+            rendered[key] = text
+            texts.append((t, text))
+        self.rendered = rendered
+        return texts
+
+    def update(self):
+        """Import changed csv files, return the number of trade dates
+        linked again, None if nothing changed
+        """
+        folders = self.load_changed()
+        if not folders:
+            return None
+
+        dates = self.changed_dates(folders)
+        if not dates and self.written:
+            # links are replayed on the reloaded transactions next time
+            return 0
+
+        accounts = [self.accounts[f] for f in registry.folder_names()
+                    if f in self.accounts]
+        results = self.link(accounts, dates)
+        texts = self.render(results, dates)
+
+        if self.ledger:
+            from ledger import LedgerIndex
+            imported = LedgerIndex.from_file(self.ledger)
+            texts = [x for x in texts if not imported.take(x[0])]
+
+        with open_output(self.output) as out:
+            writer = BeancountWriter(out)
+            for _, text in texts:
+                writer.write_text(text)
+            writer.flush()
+        self.written = True
+        return len(dates)
+
+    def run(self):
+        """Update until interrupted
+        """
+        while True:
+            start = time.perf_counter()
+            try:
+                dates = self.update()
+            except Exception as e:
+                # a csv file may be half copied, try again next time
+                print("update failed: {!r}".format(e), file=sys.stderr)
+            else:
+                if dates is not None:
+                    print("{} updated, {} dates linked, {:.3f}s".format(
+                        self.output, dates, time.perf_counter() - start),
+                        file=sys.stderr)
+            time.sleep(self.interval)
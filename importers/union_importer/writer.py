@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+'''Buffered output of beancount transactions
+
+Rendered transactions are collected in a buffer and written in large
+chunks instead of one print() per transaction. open_output writes to a
+temporary file next to the target and replaces it only after the whole
+output is written, so a failed run never leaves a truncated ledger.
+'''
+
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+
+SEPARATOR = "\n\n\n"
+CHUNK_SIZE = 1 << 20
+
+
+class BeancountWriter(object):
+    def __init__(self, out=None, chunk_size=CHUNK_SIZE):
+        super(BeancountWriter, self).__init__()
+        if out is None:
+            out = sys.stdout
+        self.out = out
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_size = 0
+        self.count = 0
+
+    def write(self, transaction):
+        self.write_text(transaction.beancount_repr())
+
+    def write_text(self, text):
+        """Write a transaction rendered before
+        """
+        self.pending.append(text)
+        self.pending_size += len(text)
+        self.count += 1
+        if self.pending_size >= self.chunk_size:
+            self.flush()
+
+    def write_all(self, transactions):
+        for t in transactions:
+            self.write(t)
+        self.flush()
+
+    def flush(self):
+        """Write pending transactions, each one followed by SEPARATOR
+        """
+        if self.pending:
+            self.pending.append('')
+            self.out.write(SEPARATOR.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+        self.out.flush()
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+@contextmanager
+def open_output(path=None):
+    """Yield stdout if path is None or '-', otherwise a file which
+    replaces path atomically when the block succeeds
+    """
+    if path is None or path == '-':
+        yield sys.stdout
+        return
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(
+        prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            yield out
+            out.flush()
+            os.fsync(out.fileno())
+        if os.path.exists(path):
+            os.chmod(temp, os.stat(path).st_mode & 0o7777)
+        else:
+            os.chmod(temp, 0o666 & ~_umask())
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise